@@ -0,0 +1,234 @@
+"""
+Timing benchmarks for statistics_and_trends.py.
+Run with `python benchmarks.py`; each benchmark prints the best of a few
+repeats so changes can be compared against the previous implementation.
+`--scales 1 10 100` also times every stage on synthetic data with the
+schema of data.csv at 1x, 10x and 100x its 588,101 rows, and
+`--shards 8` times aggregate_shards on 8 synthetic shards of that size
+with 1, 2, 4, ... worker processes.
+"""
+
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import timeit
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import statistics_and_trends as st
+
+
+def best_time(func, repeat=5):
+    """
+    Returns the best wall time in seconds of func over repeat calls.
+    """
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def bench_bucket_ads(df, threshold=100):
+    """
+    Compares the vectorized bucket_ads against the row-wise apply() that
+    plot_categorical_plot previously used to build "ads_category".
+    """
+    total_ads = df["total ads"]
+
+    def with_apply():
+        return total_ads.apply(
+            lambda x: (f"Above {threshold} Ads" if x > threshold
+                       else f"Below {threshold} Ads"))
+
+    def with_bucket_ads():
+        return st.bucket_ads(total_ads, [threshold])
+
+    assert np.array_equal(with_apply().to_numpy(dtype=str),
+                          np.asarray(with_bucket_ads(), dtype=str))
+    apply_time = best_time(with_apply)
+    bucket_time = best_time(with_bucket_ads)
+    print(f'bucket_ads: apply {apply_time * 1e3:.1f} ms, '
+          f'vectorized {bucket_time * 1e3:.1f} ms '
+          f'({apply_time / bucket_time:.0f}x)')
+    return
+
+
+def frame_mb(df):
+    """
+    Returns the deep memory usage of df in MB.
+    """
+    return df.memory_usage(deep=True).sum() / 2**20
+
+
+def bench_plot_memory(df):
+    """
+    Compares the memory held by df after the old mutating binning, which
+    added "log_ads_bin" and "ads_category" and cast "converted" to int,
+    with the non-mutating aggregate(), whose peak allocation is traced.
+    """
+    before = frame_mb(df)
+    old = df.copy()
+    bins = np.logspace(0, np.log10(old["total ads"].max()), num=10)
+    old["log_ads_bin"] = pd.cut(old["total ads"], bins=bins)
+    old["converted"] = old["converted"].astype(int)
+    old["ads_category"] = old["total ads"].apply(
+        lambda x: "Above 100 Ads" if x > 100 else "Below 100 Ads")
+    tracemalloc.start()
+    st.aggregate(df)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    print(f'frame memory: {before:.1f} MB before plotting, '
+          f'{frame_mb(old):.1f} MB after mutating binning, '
+          f'{frame_mb(df):.1f} MB after aggregate '
+          f'(transient peak {peak:.1f} MB)')
+    return
+
+
+def read_plots(outdir):
+    """
+    Returns the bytes of the three PNGs written by render_plots to outdir.
+    """
+    names = ['relational_plot.png', 'statistical_plot.png',
+             'categorical_plot.png']
+    plots = []
+    for name in names:
+        with open(os.path.join(outdir, name), 'rb') as f:
+            plots.append(f.read())
+    return plots
+
+
+def bench_render(df):
+    """
+    Times sequential and process-pool rendering of the three plots into
+    a temporary directory and checks that both write identical PNGs.
+    """
+    summary = st.aggregate(df)
+    with tempfile.TemporaryDirectory() as tmp:
+        sequential = best_time(
+            lambda: st.render_plots(summary, outdir=tmp), repeat=1)
+        expected = read_plots(tmp)
+        parallel = best_time(
+            lambda: st.render_plots(summary, parallel=True, outdir=tmp),
+            repeat=1)
+        identical = read_plots(tmp) == expected
+    print(f'render_plots: sequential {sequential:.2f} s, '
+          f'parallel {parallel:.2f} s, identical output: {identical}')
+    return
+
+
+BASE_ROWS = 588_101
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday",
+        "Saturday", "Sunday"]
+
+
+def make_synthetic(n_rows, seed=0):
+    """
+    Returns a DataFrame with the columns and dtypes of data.csv: a 96/4
+    ad/psa split, a heavy-tailed (log-normal) total ads with median 13
+    capped at 2065, and a conversion probability that grows with the
+    number of ads and is slightly lower for psa.
+    """
+    rng = np.random.default_rng(seed)
+    is_psa = rng.random(n_rows) < 0.04
+    total_ads = np.clip(np.ceil(rng.lognormal(np.log(13), 1.2, n_rows)),
+                        1, 2065)
+    rate = 0.002 + 0.18 * (1 - np.exp(-total_ads / 100))
+    rate[is_psa] *= 0.75
+    hours = np.clip(np.rint(rng.normal(14.5, 4.8, n_rows)), 0, 23)
+    return pd.DataFrame({
+        "user id": 900_000 + rng.permutation(n_rows).astype(np.uint32),
+        "test group": pd.Categorical.from_codes(is_psa.astype(np.int8),
+                                                ["ad", "psa"]),
+        "converted": rng.random(n_rows) < rate,
+        "total ads": total_ads.astype(np.uint16),
+        "most ads day": pd.Categorical.from_codes(
+            rng.integers(0, 7, n_rows), DAYS),
+        "most ads hour": hours.astype(np.uint8),
+    })
+
+
+def quiet_preprocessing(df):
+    """
+    Runs preprocessing on df without printing its output.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return st.preprocessing(df)
+
+
+def bench_scale(scale, repeat=3):
+    """
+    Writes a synthetic CSV with scale times the rows of data.csv and
+    prints the best time of loading it, preprocessing, aggregating, each
+    plot and statistical_analysis.
+    """
+    n_rows = BASE_ROWS * scale
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data.csv')
+        make_synthetic(n_rows).to_csv(path, index_label='')
+        df = st.load_data(path, cache=False)
+        summary = st.aggregate(df)
+        timings = {
+            'read_csv': lambda: st.load_data(path, cache=False),
+            'load_cached': lambda: st.load_data(path),
+            'preprocessing': lambda: quiet_preprocessing(df),
+            'aggregate': lambda: st.aggregate(df),
+            'statistical_analysis':
+                lambda: st.statistical_analysis(df, 'total ads'),
+        }
+        for stage in st.PLOT_STAGES:
+            timings[stage] = (lambda stage=stage: st.render_plots(
+                summary, outdir=tmp, stages=[stage]))
+        for name, func in timings.items():
+            elapsed = best_time(func, repeat)
+            print(f'{scale}x ({n_rows:,} rows) {name}: {elapsed:.3f} s')
+    return
+
+
+def bench_shards(n_shards, repeat=3):
+    """
+    Writes n_shards synthetic CSVs the size of data.csv and prints the
+    best time and throughput of aggregate_shards over them for each
+    power-of-two number of workers up to the CPU count.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        for shard in range(n_shards):
+            make_synthetic(BASE_ROWS, seed=shard).to_csv(
+                os.path.join(tmp, f'part{shard:03d}.csv'), index_label='')
+        paths = st.shard_paths(tmp)
+        # Build the per-shard caches once, so only aggregation is timed
+        st.aggregate_shards(paths, ['total ads'], cache=True)
+        workers = 1
+        while workers <= max(1, min(os.cpu_count() or 1, n_shards)):
+            elapsed = best_time(lambda: st.aggregate_shards(
+                paths, ['total ads'], workers, cache=True), repeat)
+            rate = n_shards * BASE_ROWS / elapsed / 1e6
+            print(f'aggregate_shards: {n_shards} shards, {workers} workers '
+                  f'{elapsed:.3f} s ({rate:.1f} M rows/s)')
+            workers *= 2
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scales', nargs='*', type=int, default=[],
+                        help='synthetic data sizes to time, as multiples '
+                             'of data.csv (e.g. 1 10 100)')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='number of synthetic shards to aggregate in '
+                             'parallel (default: 0, skip)')
+    args = parser.parse_args()
+    df = st.load_data('data.csv')
+    bench_bucket_ads(df)
+    bench_plot_memory(df)
+    bench_render(df)
+    for scale in args.scales:
+        bench_scale(scale)
+    if args.shards:
+        bench_shards(args.shards)
+    return
+
+
+if __name__ == '__main__':
+    main()
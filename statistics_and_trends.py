@@ -9,130 +9,1691 @@ and ensure your code is PEP-8 compliant, including docstrings.
 """
 
 
-import matplotlib.pyplot as plt
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
 import numpy as np
 import pandas as pd
-import scipy.stats as ss
-import seaborn as sns
+
+# matplotlib and seaborn are imported inside the plotting functions, so
+# analysis-only runs do not pay their import time
+
+
+# Explicit schema for data.csv, so read_csv does not infer int64/object
+SCHEMA = {
+    "user id": "uint32",
+    "test group": "category",
+    "converted": "bool",
+    "total ads": "uint16",
+    "most ads day": "category",
+    "most ads hour": "uint8",
+}
+
+MOMENT_NAMES = ["mean", "std", "skew", "excess kurtosis"]
+
+# Columns each stage of main() reads, used to prune the load
+STAGE_COLUMNS = {
+    "preprocess": list(SCHEMA),
+    "relational": ["test group", "converted", "total ads"],
+    "categorical": ["test group", "converted", "total ads"],
+    "statistical": ["test group", "converted", "total ads"],
+    "significance": ["test group", "converted", "total ads",
+                     "most ads day", "most ads hour"],
+    "sequential": ["test group", "converted", "total ads"],
+}
+
+
+def required_columns(stages, cols=()):
+    """
+    Returns the schema columns needed to run the given stages plus the
+    columns analysed by statistical_analysis, in file order.
+    """
+    needed = set(cols)
+    for stage in stages:
+        needed.update(STAGE_COLUMNS.get(stage, []))
+    return [col for col in SCHEMA if col in needed]
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB, or nan on
+    platforms without the resource module.
+    """
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 2**20 if os.uname().sysname == "Darwin" else peak / 2**10
+
+
+def read_csv_schema(path, usecols=None):
+    """
+    Reads the CSV with the dtypes in SCHEMA, keeping only usecols if given.
+    """
+    names = list(SCHEMA) if usecols is None else list(usecols)
+    return pd.read_csv(
+        path, index_col=0,
+        usecols=lambda c: c in names or c.startswith("Unnamed"),
+        dtype={col: SCHEMA[col] for col in names})
+
+
+@contextmanager
+def instrument(stage, report, rows=None):
+    """
+    Records the wall time, CPU time and peak RSS of the enclosed block
+    (or decorated function) as a dict appended to report. The dict is
+    yielded so the block can set its "rows" count. If tracemalloc is
+    tracing (main's --trace-memory), the peak allocation above the
+    starting level is recorded too, otherwise it is None: tracing slows
+    allocation-heavy stages, imports above all, several times over.
+    Allocations made in pool worker processes (see _untraced) are not
+    counted.
+    """
+    record = {"stage": stage, "rows": rows, "peak_alloc_mb": None}
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_s"] = time.perf_counter() - wall
+        record["cpu_s"] = time.process_time() - cpu
+        if tracing:
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            record["peak_alloc_mb"] = peak / 2**20
+        record["peak_rss_mb"] = peak_rss_mb()
+        report.append(record)
+        alloc = ('' if record["peak_alloc_mb"] is None
+                 else f'peak alloc {record["peak_alloc_mb"]:.1f} MB, ')
+        print(f'{stage} took {record["wall_s"]:.3f} s '
+              f'(CPU {record["cpu_s"]:.3f} s, {alloc}'
+              f'rows {record["rows"]})')
+
+
+def _untraced():
+    """
+    Process pool initializer that stops the tracemalloc tracing a worker
+    inherits from a traced parent; the parent never sees the worker's
+    allocations, so tracing there would only slow it down.
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return
+
+
+def write_report(report, path, **info):
+    """
+    Writes the stage records in report, plus any extra info, as JSON.
+    """
+    with open(path, "w") as f:
+        json.dump(dict(info, stages=report), f, indent=2)
+    return
+
+
+def _file_hash(path):
+    """
+    Returns the SHA-1 hex digest of a file, read in 1 MB blocks.
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _replace_file(path, write):
+    """
+    Writes a file by calling write with a binary file object opened under
+    a temporary name beside path, then renames it over path. Readers of
+    the old file, including live memory maps of it, keep seeing the old
+    contents and never a partly written file.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return
+
+
+def _write_meta(cache_dir, meta):
+    """
+    Atomically replaces the meta.json of cache_dir with meta.
+    """
+    _replace_file(os.path.join(cache_dir, "meta.json"),
+                  lambda f: f.write(json.dumps(meta).encode()))
+    return
+
+
+def _write_cache(df, cache_dir, meta):
+    """
+    Writes each column of df as a .npy file in cache_dir, with the
+    categorical columns stored as integer codes, plus a meta.json
+    describing the columns and the source file. Returns that metadata.
+    Column files are named after the source hash and meta.json is
+    replaced last, so frames still mapping an earlier cache, and other
+    processes reading it, are unaffected by a rebuild.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    columns = []
+    for i, col in enumerate(df.columns):
+        entry = {"name": col, "file": f"{meta['sha1'][:16]}-{i}.npy"}
+        if SCHEMA[col] == "category":
+            values = df[col].astype("category")
+            entry["categories"] = [str(c) for c in values.cat.categories]
+            data = values.cat.codes.to_numpy()
+        else:
+            data = df[col].to_numpy(dtype=SCHEMA[col])
+        _replace_file(os.path.join(cache_dir, entry["file"]),
+                      partial(np.save, arr=data))
+        columns.append(entry)
+    meta = dict(meta, columns=columns, index_name=df.index.name)
+    _write_meta(cache_dir, meta)
+    # Unlinking the previous build's files leaves open maps of them valid
+    current = {entry["file"] for entry in columns}
+    for name in os.listdir(cache_dir):
+        if name.endswith(".npy") and name not in current:
+            os.remove(os.path.join(cache_dir, name))
+    return meta
+
+
+def _read_cache(cache_dir, meta, usecols=None):
+    """
+    Rebuilds the DataFrame from the memory-mapped .npy files in cache_dir,
+    loading only usecols if given. The frame is built without copying, so
+    its columns stay read-only memmaps and are paged in only as used.
+    """
+    data = {}
+    for entry in meta["columns"]:
+        if usecols is not None and entry["name"] not in usecols:
+            continue
+        values = np.load(os.path.join(cache_dir, entry["file"]),
+                         mmap_mode="r")
+        if "categories" in entry:
+            data[entry["name"]] = pd.Categorical.from_codes(
+                values, categories=entry["categories"])
+        else:
+            data[entry["name"]] = values
+    df = pd.DataFrame(data, copy=False)
+    df.index.name = meta["index_name"]
+    return df
+
+
+def shard_paths(path):
+    """
+    Returns the CSV files a dataset path refers to: every *.csv file in
+    a directory, the regular files matching a glob pattern (so not the
+    .cache directories load_data writes beside them), or the path
+    itself, in sorted order.
+    """
+    if os.path.isdir(path):
+        paths = glob.glob(os.path.join(path, "*.csv"))
+    elif glob.has_magic(path):
+        paths = glob.glob(path)
+    else:
+        return [path]
+    paths = [shard for shard in paths if os.path.isfile(shard)]
+    if not paths:
+        raise FileNotFoundError(f"no CSV files match {path!r}")
+    return sorted(paths)
+
+
+def load_data(path="data.csv", cache=True, usecols=None):
+    """
+    Loads the A/B dataset with the dtypes in SCHEMA, keeping only usecols
+    if given. On the first call the CSV is parsed and stored
+    as a typed columnar cache next to it (one memory-mappable .npy file
+    per column), which later calls read instead of the CSV. The cache is
+    rebuilt when the CSV's contents change; a changed mtime alone only
+    triggers a hash check. path may also be a directory or glob of CSV
+    shards (see shard_paths), which are loaded one by one and
+    concatenated.
+    """
+    paths = shard_paths(path)
+    if paths != [path]:
+        df = pd.concat([load_data(shard, cache, usecols) for shard in paths],
+                       ignore_index=True)
+        # Shards may see different categories, which concat turns to object
+        return df.astype({col: dtype for col, dtype in SCHEMA.items()
+                          if col in df and dtype == "category"})
+    if not cache:
+        return read_csv_schema(path, usecols)
+    cache_dir = path + ".cache"
+    meta_path = os.path.join(cache_dir, "meta.json")
+    stat = os.stat(path)
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    if meta is not None and meta["mtime_ns"] == stat.st_mtime_ns:
+        return _read_cache(cache_dir, meta, usecols)
+    digest = _file_hash(path)
+    if meta is not None and meta["sha1"] == digest:
+        meta["mtime_ns"] = stat.st_mtime_ns
+        try:
+            _write_meta(cache_dir, meta)
+        except OSError:
+            pass
+        return _read_cache(cache_dir, meta, usecols)
+    df = read_csv_schema(path)
+    try:
+        meta = _write_cache(df, cache_dir, {"mtime_ns": stat.st_mtime_ns,
+                                            "sha1": digest})
+    except OSError:
+        # Read-only input directory: use the parsed CSV without a cache
+        return df if usecols is None else df[[col for col in df.columns
+                                              if col in usecols]]
+    return _read_cache(cache_dir, meta, usecols)
+
+
+def bucket_ads(values, thresholds=(100,), labels=None):
+    """
+    Buckets values by the sorted cut points in thresholds, a value equal
+    to a cut point falling in the lower bucket, and returns an ordered
+    pd.Categorical. Default labels are "Below t Ads" and "Above t Ads"
+    for a single threshold t, with "a-b Ads" buckets in between when
+    several are given.
+    """
+    thresholds = sorted(thresholds)
+    if labels is None:
+        labels = ([f"Below {thresholds[0]} Ads"]
+                  + [f"{lo + 1}-{hi} Ads"
+                     for lo, hi in zip(thresholds, thresholds[1:])]
+                  + [f"Above {thresholds[-1]} Ads"])
+    codes = np.searchsorted(thresholds, np.asarray(values), side="left")
+    return pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+
+
+# Log-bin codes and labels by (content digest, num_bins), oldest first
+_BIN_CACHE = {}
+BIN_CACHE_SIZE = 8
+
+
+def log_bin(values, num_bins=10):
+    """
+    Assigns values to num_bins - 1 right-closed logarithmic bins from 1 to
+    their maximum, as pd.cut over np.logspace does, and returns the int8
+    bin codes (-1 outside the bins) with the "lo-hi" bin labels. Results
+    are memoized on a digest of the values, so re-rendering or sweeping
+    other parameters over the same column does not re-bin it.
+    """
+    values = np.ascontiguousarray(values)
+    key = (hashlib.blake2b(values.view(np.uint8), digest_size=16).digest(),
+           values.dtype.str, num_bins)
+    if key in _BIN_CACHE:
+        return _BIN_CACHE[key]
+    bins = np.logspace(0, np.log10(values.max()), num=num_bins)
+    labels = [f"{int(lo)}-{int(hi)}" for lo, hi in zip(bins, bins[1:])]
+    if values.dtype.kind == "u":
+        # Bin each distinct value once and look the codes up
+        domain = np.arange(int(values.max()) + 1)
+        codes = _bin_codes(domain, bins)[values]
+    else:
+        codes = _bin_codes(values, bins)
+    if len(_BIN_CACHE) >= BIN_CACHE_SIZE:
+        del _BIN_CACHE[next(iter(_BIN_CACHE))]
+    _BIN_CACHE[key] = codes, labels
+    return codes, labels
+
+
+def _bin_codes(values, bins):
+    """
+    Returns the index i of the bin (bins[i], bins[i+1]] holding each
+    value, or -1 if it is in none of them.
+    """
+    codes = np.searchsorted(bins, values, side="left") - 1
+    codes[(codes < 0) | (codes >= len(bins) - 1)] = -1
+    return codes.astype(np.int8)
+
+
+def _rate_series(counts, groups, labels, names, ci=None):
+    """
+    Returns the conversion rates (%) of the non-empty cells of counts, an
+    array of (not converted, converted) tallies per group and label, as
+    a Series indexed by (group, label) named names. If ci holds (low,
+    high) arrays over the same cells, a DataFrame of those bounds for
+    the non-empty cells is returned instead.
+    """
+    n = counts.sum(axis=-1)
+    g, k = np.nonzero(n)
+    index = pd.MultiIndex.from_arrays(
+        [[groups[i] for i in g], [labels[j] for j in k]], names=names)
+    if ci is not None:
+        return pd.DataFrame({"low": ci[0][g, k], "high": ci[1][g, k]},
+                            index=index)
+    return pd.Series(counts[g, k, 1] / n[g, k] * 100, index=index)
+
+
+def aggregate(df, threshold=100, num_bins=10,
+              corr_cols=("converted", "total ads"), method="pearson",
+              n_boot=0, seed=0, workers=1, alpha=0.05):
+    """
+    Computes everything the three plot functions need in one pass over
+    df: np.bincount over a combined integer code of (test group, log bin,
+    ads category, converted) gives the tallies of every cell in a single
+    call, from which the per-bin and per-category conversion rates are
+    derived. The per-group correlation matrices of corr_cols come from
+    correlation with the given method. With n_boot > 0, the rates get
+    (1 - alpha) bootstrap intervals, resampling the cell tallies of each
+    test group (see bootstrap) with the given seed and workers. The bins
+    are held in transient arrays, so df itself is never modified.
+    """
+    # Define logarithmic bins based on total ads
+    bin_codes, bin_labels = log_bin(df["total ads"].to_numpy(), num_bins)
+    groups = df["test group"].astype("category")
+    ads_category = bucket_ads(df["total ads"].to_numpy(), [threshold])
+
+    # Cell code; bin code -1 (outside the bins) is shifted to slot 0
+    shape = (len(groups.cat.categories), len(bin_labels) + 1,
+             len(ads_category.categories), 2)
+    code = groups.cat.codes.to_numpy(dtype=np.int64)
+    code = code * shape[1] + bin_codes + 1
+    code = code * shape[2] + ads_category.codes
+    code = code * 2 + df["converted"].to_numpy(dtype=np.int64)
+    # Rows without a test group (code -1) have negative codes; drop them
+    counts = np.bincount(code[code >= 0],
+                         minlength=np.prod(shape)).reshape(shape)
+
+    summary = _summarise_cells(
+        counts, list(groups.cat.categories), bin_labels,
+        list(ads_category.categories), n_boot, seed, workers, alpha)
+    summary["statistical"] = correlation(df, corr_cols, method,
+                                         by="test group")
+    summary.update(threshold=threshold, method=method)
+    return summary
+
+
+def _summarise_cells(counts, names, bin_labels, categories, n_boot=0,
+                     seed=0, workers=1, alpha=0.05):
+    """
+    Derives the per-bin and per-category conversion rates, and their
+    bootstrap intervals if n_boot > 0, from the (test group, log bin,
+    ads category, converted) tallies built by aggregate.
+    """
+    binned = counts[:, 1:].sum(axis=2)
+    by_category = counts.sum(axis=1)
+    relational = _rate_series(binned, names, bin_labels,
+                              ["test group", "log_ads_bin"])
+    categorical = _rate_series(by_category, names, categories,
+                               ["test group", "ads_category"]).sort_index()
+    relational_ci = categorical_ci = None
+    if n_boot:
+        samples = bootstrap(counts.reshape(len(names), -1),
+                            partial(_binned_rates, shape=counts.shape[1:]),
+                            n_boot, seed, workers)
+        low, high = bootstrap_ci(samples, alpha)
+        split = len(bin_labels)
+        relational_ci = _rate_series(
+            binned, names, bin_labels, ["test group", "log_ads_bin"],
+            (low[:, :split], high[:, :split]))
+        categorical_ci = _rate_series(
+            by_category, names, categories, ["test group", "ads_category"],
+            (low[:, split:], high[:, split:])).sort_index()
+    return {"relational": relational, "categorical": categorical,
+            "relational_ci": relational_ci,
+            "categorical_ci": categorical_ci}
+
+
+class StatsState:
+    """
+    Mergeable, persistent tallies behind the plots and the total ads
+    moments: for each test group, the number of rows (not converted,
+    converted) at every value of total ads. All conversion rates, log
+    bins, categories, the converted/total ads correlation and the moments
+    are derived from this histogram, so states built from separate files
+    (e.g. one per day) can be merged by adding them and saved between
+    runs, and the plots regenerated without re-reading old data. The
+    (absolute path, SHA-1) pair of every file folded in is kept in
+    sources, so the same file cannot be counted twice, while distinct
+    files with equal bytes (such as header-only days) are each counted.
+    """
+
+    def __init__(self, groups=("ad", "psa")):
+        self.groups = list(groups)
+        self.hist = np.zeros((len(self.groups), 0, 2), dtype=np.int64)
+        self.sources = set()
+
+    def _resize(self, size):
+        """
+        Pads the histogram with zeros up to size values of total ads.
+        """
+        if size > self.hist.shape[1]:
+            pad = size - self.hist.shape[1]
+            self.hist = np.pad(self.hist, ((0, 0), (0, pad), (0, 0)))
+        return
+
+    def _check_source(self, path, digest=None):
+        """
+        Returns the (absolute path, SHA-1) key of the file at path,
+        hashing it unless digest is given, and raises ValueError if that
+        file was already folded into the state.
+        """
+        key = (os.path.abspath(path), digest or _file_hash(path))
+        if key in self.sources:
+            raise ValueError(f"{path} was already folded into the state")
+        return key
+
+    def update(self, df, source=None, digest=None):
+        """
+        Folds the rows of df (test group, converted and total ads) into
+        the state and returns it. source is the path of the file df was
+        read from, which is recorded so it cannot be folded in again;
+        digest is its SHA-1, if already known.
+        """
+        if source is not None:
+            self.sources.add(self._check_source(source, digest))
+        group = df["test group"].to_numpy()
+        arm = np.full(len(df), -1, dtype=np.int64)
+        for g, name in enumerate(self.groups):
+            arm[group == name] = g
+        keep = arm >= 0
+        x = df["total ads"].to_numpy(dtype=np.int64)[keep]
+        if not len(x):
+            return self
+        self._resize(int(x.max()) + 1)
+        size = self.hist.shape[1]
+        key = (arm[keep] * size + x) * 2 + df["converted"].to_numpy(
+            dtype=np.int64)[keep]
+        self.hist += np.bincount(key, minlength=self.hist.size).reshape(
+            self.hist.shape)
+        return self
+
+    def update_csv(self, path, chunksize=1_000_000):
+        """
+        Folds a CSV into the state chunk by chunk and returns the state,
+        raising ValueError if the file was already folded in.
+        """
+        key = self._check_source(path)
+        cols = ["test group", "converted", "total ads"]
+        for chunk in pd.read_csv(path, usecols=cols, chunksize=chunksize,
+                                 dtype={col: SCHEMA[col] for col in cols}):
+            self.update(chunk)
+        self.sources.add(key)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the tallies of another state with the same groups and
+        returns self. Raises ValueError, leaving self unchanged, if both
+        states hold the same file.
+        """
+        if other.groups != self.groups:
+            raise ValueError("cannot merge states with different groups")
+        common = sorted(path for path, _ in self.sources & other.sources)
+        if common:
+            raise ValueError("already folded into the state: "
+                             + ", ".join(common))
+        self.sources |= other.sources
+        self._resize(other.hist.shape[1])
+        self.hist[:, :other.hist.shape[1]] += other.hist
+        return self
+
+    def save(self, path):
+        """
+        Writes the state to path as a compressed .npz file.
+        """
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f, hist=self.hist, groups=np.array(self.groups),
+                paths=np.array([path for path, _ in self.sources],
+                               dtype=str),
+                digests=np.array([digest for _, digest in self.sources],
+                                 dtype=str))
+        return
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a state written by save.
+        """
+        with np.load(path) as data:
+            state = cls([str(g) for g in data["groups"]])
+            state.hist = data["hist"].astype(np.int64)
+            state.sources = set(zip(data["paths"].tolist(),
+                                    data["digests"].tolist()))
+        return state
+
+    def rows(self):
+        """
+        Returns the number of rows folded into the state.
+        """
+        return int(self.hist.sum())
+
+    def moments(self):
+        """
+        Returns the total ads moments of each group, as
+        statistical_analysis(df, "total ads", by="test group") would.
+        """
+        values = np.arange(self.hist.shape[1], dtype=np.float64)
+        moments = _weighted_moments(self.hist.sum(axis=2)[:, None], values)
+        return pd.DataFrame(moments, index=self.groups, columns=MOMENT_NAMES)
+
+    def summary(self, threshold=100, num_bins=10, n_boot=0, seed=0,
+                workers=1, alpha=0.05):
+        """
+        Returns the same summary as aggregate (with Pearson correlations)
+        for the rows folded into the state, ready for the plot functions.
+        """
+        observed = np.flatnonzero(self.hist.sum(axis=(0, 2)))
+        if not len(observed):
+            raise ValueError("the state holds no rows")
+        domain = np.arange(observed[-1] + 1, dtype=np.uint16)
+        bin_codes, bin_labels = log_bin(domain, num_bins)
+        ads_category = bucket_ads(domain, [threshold])
+        shape = (len(self.groups), len(bin_labels) + 1,
+                 len(ads_category.categories), 2)
+        hist = self.hist[:, :len(domain)]
+        cell = (bin_codes.astype(np.int64) + 1) * shape[2] + ads_category.codes
+        key = ((np.arange(shape[0])[:, None, None] * shape[1] * shape[2]
+                + cell[None, :, None]) * 2 + np.arange(2))
+        counts = np.bincount(key.ravel(), weights=hist.ravel(),
+                             minlength=np.prod(shape))
+        counts = counts.astype(np.int64).reshape(shape)
+        summary = _summarise_cells(counts, self.groups, bin_labels,
+                                   list(ads_category.categories), n_boot,
+                                   seed, workers, alpha)
+
+        x = domain.astype(np.float64)
+        rows = hist.sum(axis=2)
+        c = hist[..., 1].sum(axis=1)
+        sx, sx2, cx = rows @ x, rows @ (x * x), hist[..., 1] @ x
+        summary["statistical"] = {
+            group: _corr_from_sums(rows[g].sum(), np.array([c[g], sx[g]]),
+                                   np.array([[c[g], cx[g]], [cx[g], sx2[g]]]),
+                                   ["converted", "total ads"])
+            for g, group in enumerate(self.groups)}
+        summary.update(threshold=threshold, method="pearson")
+        return summary
+
+
+def _source_digest(path):
+    """
+    Returns the SHA-1 of a CSV, taken from its load_data cache when that
+    is current so the file is not read again.
+    """
+    try:
+        with open(os.path.join(path + ".cache", "meta.json")) as f:
+            meta = json.load(f)
+        if meta["mtime_ns"] == os.stat(path).st_mtime_ns:
+            return meta["sha1"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return _file_hash(path)
+
+
+def _shard_partial(path, cols=(), cache=False):
+    """
+    Returns the mergeable partial summary of one CSV shard: its
+    StatsState (conversion tallies per test group and total ads, from
+    which the plots and correlations follow) and the moment accumulator
+    of cols. With cache the shard is read with load_data; otherwise its
+    bytes are read once, both hashed for the state's sources and parsed.
+    """
+    cols = list(cols)
+    usecols = required_columns(["statistical"], cols)
+    if cache:
+        df = load_data(path, usecols=usecols)
+        digest = _source_digest(path)
+    else:
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        df = read_csv_schema(io.BytesIO(data), usecols)
+    return (StatsState().update(df, source=path, digest=digest),
+            _chunk_moments(df[cols].to_numpy()))
+
+
+def aggregate_shards(paths, cols=(), workers=1, cache=False):
+    """
+    Summarises CSV shards independently, in a pool of workers processes
+    when workers > 1, and reduces the partial summaries. Returns the
+    merged StatsState and the moments of cols as a DataFrame, matching
+    statistical_analysis on the concatenated shards. Each worker holds
+    only one shard in memory, so throughput grows with the number of
+    workers until the disk is the bottleneck. Shards are parsed from
+    CSV each time unless cache, which writes a .cache directory beside
+    every shard (see load_data).
+    """
+    cols = list(cols)
+    task = partial(_shard_partial, cols=cols, cache=cache)
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_untraced) as pool:
+            parts = list(pool.map(task, paths))
+    else:
+        parts = list(map(task, paths))
+    state, acc = parts[0]
+    for part_state, part_acc in parts[1:]:
+        state.merge(part_state)
+        acc = _merge_moments(acc, part_acc)
+    moments = _finalise_moments(acc)
+    return state, pd.DataFrame(dict(zip(MOMENT_NAMES, moments)), index=cols)
+
+
+def _cross_sums(x, codes, n_groups):
+    """
+    Returns the per-group count n (n_groups,), column sums s (n_groups, k)
+    and cross-product sums S (n_groups, k, k) of the rows of x (n, k),
+    using one weighted np.bincount per column and column pair. Rows with
+    a missing group (code -1) are left out.
+    """
+    keep = codes >= 0
+    x, codes = x[keep], codes[keep]
+    n = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    k = x.shape[1]
+    s = np.empty((n_groups, k))
+    cross = np.empty((n_groups, k, k))
+    for i in range(k):
+        s[:, i] = np.bincount(codes, weights=x[:, i], minlength=n_groups)
+        for j in range(i, k):
+            cross[:, i, j] = cross[:, j, i] = np.bincount(
+                codes, weights=x[:, i] * x[:, j], minlength=n_groups)
+    return n, s, cross
+
+
+def _corr_from_sums(n, s, cross, cols):
+    """
+    Returns the Pearson correlation matrix of cols as a DataFrame from
+    one group's count, column sums and cross-product sums.
+    """
+    cov = cross - np.outer(s, s) / n
+    std = np.sqrt(np.diag(cov))
+    return pd.DataFrame(cov / np.outer(std, std), index=cols, columns=cols)
+
+
+def stream_correlations(path, cols=("converted", "total ads"),
+                        by="test group", chunksize=1_000_000):
+    """
+    Returns the correlation matrix of cols for each value of by, read
+    from the CSV in chunks. Only n, the column sums and the cross-product
+    sums per group are kept between chunks, so the result (which can be
+    passed to plot_statistical_plot as {"statistical": ...}) never needs
+    the data in memory. The sums are exact for the integer columns of
+    SCHEMA up to ~10**15 in total.
+    """
+    cols = list(cols)
+    totals = {}
+    for chunk in pd.read_csv(path, usecols=cols + [by], chunksize=chunksize,
+                             dtype={col: SCHEMA[col] for col in cols + [by]}):
+        keys = chunk[by].astype("category")
+        sums = _cross_sums(chunk[cols].to_numpy(dtype=np.float64),
+                           keys.cat.codes.to_numpy(),
+                           len(keys.cat.categories))
+        for g, group in enumerate(keys.cat.categories):
+            part = [a[g] for a in sums]
+            old = totals.get(group)
+            totals[group] = (part if old is None
+                             else [a + b for a, b in zip(old, part)])
+    return {group: _corr_from_sums(*totals[group], cols)
+            for group in sorted(totals)}
+
+
+CORR_METHODS = ["pearson", "spearman", "kendall", "pointbiserial"]
+
+# Largest table of distinct value pairs _kendall_tau builds before
+# falling back to scipy's sort-based kendalltau
+KENDALL_TABLE_SIZE = 1 << 22
+
+
+def _dense_codes(values):
+    """
+    Returns integer codes of values that preserve their order, with the
+    number of codes. Bool and 8/16-bit unsigned columns are their own
+    codes, so no sort is needed.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "b" or (values.dtype.kind == "u"
+                                    and values.dtype.itemsize <= 2):
+        codes = values.astype(np.intp)
+        return codes, int(codes.max()) + 1 if len(codes) else 0
+    uniques, codes = np.unique(values, return_inverse=True)
+    return codes, len(uniques)
+
+
+def _rank_column(values):
+    """
+    Returns the ranks of values, ties getting their average rank. Bool
+    and 8/16-bit unsigned columns (such as "total ads") are ranked in
+    O(n) by counting each value, other columns by sorting.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in "bu" or values.dtype.itemsize > 2:
+        return pd.Series(values).rank().to_numpy()
+    codes, size = _dense_codes(values)
+    counts = np.bincount(codes, minlength=size)
+    cum = np.cumsum(counts)
+    # Ranks cum - count + 1 ... cum share their mean
+    return (cum - (counts - 1) / 2)[codes]
+
+
+def _kendall_tau(a, b):
+    """
+    Returns Kendall's tau-b of a and b from their table of value-pair
+    counts, whose 2-D cumulative sums give the concordant and discordant
+    pair counts in time proportional to the table size.
+    """
+    codes_a, size_a = _dense_codes(a)
+    codes_b, size_b = _dense_codes(b)
+    if size_a * size_b > KENDALL_TABLE_SIZE:
+        import scipy.stats as ss
+
+        return ss.kendalltau(a, b).statistic
+    table = np.bincount(codes_a * size_b + codes_b,
+                        minlength=size_a * size_b).reshape(size_a, size_b)
+    # larger[i, j] (smaller[i, j]): rows with a larger a and a larger
+    # (smaller) b than the cell (i, j)
+    tail = table[::-1].cumsum(axis=0)[::-1]
+    larger = np.zeros_like(table)
+    larger[:-1, :-1] = tail[1:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+    smaller = np.zeros_like(table)
+    smaller[:-1, 1:] = tail[1:].cumsum(axis=1)[:, :-1]
+    concordant = (table * larger).sum()
+    discordant = (table * smaller).sum()
+    n = len(codes_a)
+    pairs = n * (n - 1) / 2
+    ties_a = (table.sum(axis=1) * (table.sum(axis=1) - 1)).sum() / 2
+    ties_b = (table.sum(axis=0) * (table.sum(axis=0) - 1)).sum() / 2
+    return (concordant - discordant) / np.sqrt((pairs - ties_a)
+                                              * (pairs - ties_b))
+
+
+def _corr_matrix(x):
+    """
+    Returns the Pearson correlation matrix of the columns of x from one
+    matrix product of the centred data with itself.
+    """
+    centred = x - x.mean(axis=0)
+    cov = centred.T @ centred
+    std = np.sqrt(np.diag(cov))
+    return cov / np.outer(std, std)
+
+
+def _method_matrix(columns, method):
+    """
+    Returns the correlation matrix of a list of column arrays.
+    """
+    if method == "kendall":
+        k = len(columns)
+        matrix = np.eye(k)
+        for i in range(k):
+            for j in range(i + 1, k):
+                matrix[i, j] = matrix[j, i] = _kendall_tau(columns[i],
+                                                           columns[j])
+        return matrix
+    if method == "spearman":
+        columns = [_rank_column(values) for values in columns]
+    return _corr_matrix(np.column_stack(columns).astype(np.float64))
 
 
-def plot_relational_plot(df):
+def correlation(df, cols, method="pearson", by=None):
+    """
+    Returns the correlation matrix of any columns of df as a DataFrame,
+    or a dict of them keyed by the values of by. "spearman" correlates
+    the within-group ranks and "kendall" gives tau-b, both counting ties
+    over the bounded integer domains of the schema instead of sorting;
+    "pointbiserial" is the Pearson formula, which is exactly the
+    point-biserial coefficient for pairs with a 0/1 column such as
+    converted. Rows are sorted by group once so that each group is a
+    contiguous view and needs a single X^T X product.
+    """
+    if method not in CORR_METHODS:
+        raise ValueError(f"method must be one of {CORR_METHODS}")
+    cols = list(cols)
+    columns = [df[col].to_numpy() for col in cols]
+    if by is None:
+        return pd.DataFrame(_method_matrix(columns, method), index=cols,
+                            columns=cols)
+    keys = df[by].astype("category")
+    codes = keys.cat.codes.to_numpy()
+    # Rows with a missing key (code -1) belong to no group
+    keep = codes >= 0
+    codes = codes[keep]
+    columns = [values[keep] for values in columns]
+    order = np.argsort(codes, kind="stable")
+    columns = [values[order] for values in columns]
+    ends = np.cumsum(np.bincount(codes, minlength=len(keys.cat.categories)))
+    result = {}
+    for group, start, end in zip(keys.cat.categories,
+                                 np.r_[0, ends[:-1]], ends):
+        part = [values[start:end] for values in columns]
+        result[group] = pd.DataFrame(_method_matrix(part, method),
+                                     index=cols, columns=cols)
+    return result
+
+
+def plot_relational_plot(df, summary=None, outdir="."):
     """
     Plots line graph that looks at the average conversion rate
     vs total ads shown, for the different test groups ads and
     psa with the total ads on the x column being log binned
-    due to the uneven spread of data. 
+    due to the uneven spread of data. The rates, and their bootstrap
+    bands if present, are taken from summary (see aggregate), which is
+    computed from df if not given, and the figure is saved in outdir.
     """
-    fig, ax = plt.subplots(1, 2, figsize=(12, 5))
-    # Define logarithmic bins based on total ads
-    bins = np.logspace(0, np.log10(df["total ads"].max()), num=10)
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
-    # Assign bins using pd.cut()
-    df["log_ads_bin"] = pd.cut(
-    df["total ads"], 
-                    bins=bins, 
-                            labels=[f"{int(bins[i])}-{int(bins[i+1])}" for i in range(len(bins) - 1)])
-
-    # Split into two groups (ad vs. psa)
-    groups = df["test group"].unique()
+    if summary is None:
+        summary = aggregate(df)
+    fig, ax = plt.subplots(1, 2, figsize=(12, 5))
+    relational = summary["relational"]
 
-    for i, group in enumerate(groups, 1):
-        subset = df[df["test group"] == group]
-        grouped = subset.groupby("log_ads_bin")["converted"].mean()
-        conversion_rates = grouped * 100
+    for i, group in enumerate(relational.index.unique("test group"), 1):
+        conversion_rates = relational.loc[group]
 
         plt.subplot(1, 2, i)
-        sns.lineplot(x=conversion_rates.index, y=conversion_rates.values, 
+        sns.lineplot(x=conversion_rates.index, y=conversion_rates.values,
                      marker="o")
+        if summary.get("relational_ci") is not None:
+            ci = summary["relational_ci"].loc[group]
+            plt.fill_between(range(len(ci)), ci["low"], ci["high"],
+                             alpha=0.2)
         plt.xticks(rotation=45)
         plt.xlabel("Total Ads Shown (Log Binned)")
         plt.ylabel("Average Conversion Rate (%)")
         plt.title(f"Conversion Rate vs Ads (Test Group: {group})")
         plt.grid()
     plt.tight_layout()
-    plt.savefig('relational_plot.png')
+    plt.savefig(os.path.join(outdir, 'relational_plot.png'))
     return
 
 
-def plot_categorical_plot(df):
+def plot_categorical_plot(df, summary=None, outdir="."):
     """
     Plots bar plot that looks at conversion rate of total ads below and above 100
-    ads for both test groups psa and ad
+    ads for both test groups psa and ad, using the rates (with bootstrap
+    error bars if present) in summary (see aggregate), which is computed
+    from df if not given, and saves it in outdir.
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    if summary is None:
+        summary = aggregate(df)
     fig, ax = plt.subplots(1, 2, figsize=(12, 5))
-    threshold = 100  # Define the threshold for ad count
-    df["converted"] = df["converted"].astype(int)  # Convert boolean to int
-    # Create categories
-    df["ads_category"] = df["total ads"].apply(
-        lambda x: "Above 100 Ads" if x > threshold else "Below 100 Ads")
-    # Split by test group
+    threshold = summary["threshold"]
     groups = ["ad", "psa"]
     for i, group in enumerate(groups):
-        subset = df[df["test group"] == group]
-        conversion_rates = subset.groupby("ads_category")["converted"].mean() * 100
+        conversion_rates = summary["categorical"].loc[group]
 
         ax = plt.subplot(1, 2, i + 1)
-        sns.barplot(x=conversion_rates.index, y=conversion_rates.values, 
+        sns.barplot(x=conversion_rates.index, y=conversion_rates.values,
                     palette="husl", ax=ax)
+        tops = conversion_rates.values
+        if summary.get("categorical_ci") is not None:
+            ci = summary["categorical_ci"].loc[group]
+            ax.errorbar(range(len(ci)), conversion_rates.values,
+                        yerr=[conversion_rates.values - ci["low"],
+                              ci["high"] - conversion_rates.values],
+                        fmt="none", ecolor="black", capsize=6)
+            tops = ci["high"].to_numpy()
         # Add text labels on bars
         for j, value in enumerate(conversion_rates.values):
-            ax.text(j, value + 1, f"{value:.2f}%", ha="center", 
+            ax.text(j, tops[j] + 1, f"{value:.2f}%", ha="center",
                     fontsize=12, color="black", fontweight="bold")
         ax.set_ylabel("Conversion Rate (%)")
         ax.set_title(f"Conversion Rate Above and Below {threshold} Ads\n(Test Group: {group})")
         ax.set_ylim(0, 100)
     plt.tight_layout()
-    plt.savefig('categorical_plot.png')
+    plt.savefig(os.path.join(outdir, 'categorical_plot.png'))
     return
 
 
-def plot_statistical_plot(df):
+def plot_statistical_plot(df, summary=None, outdir="."):
     """
-    Plots correlation heatmaps for 'converted' and 'total ads' separately
-    for test groups 'ad' and 'psa'.
+    Plots correlation heatmaps (of 'converted' and 'total ads' by
+    default) separately for test groups 'ad' and 'psa', using the
+    correlation matrices in summary (see aggregate), which is computed
+    from df if not given, and saves them in outdir.
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    if summary is None:
+        summary = aggregate(df)
+    method = summary.get("method", "pearson")
+    prefix = {"spearman": "Spearman ", "kendall": "Kendall ",
+              "pointbiserial": "Point-Biserial "}.get(method, "")
     fig, ax = plt.subplots(1, 2, figsize=(12, 5), sharey=True)
     for ax, group in zip(ax, ["ad", "psa"]):
-        subset = df[df["test group"] == group][["converted", "total ads"]]
-        corr_matrix = subset.corr()
+        corr_matrix = summary["statistical"][group]
         sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', fmt=".2f", ax=ax)
-        ax.set_title(f'Correlation Heatmap (Test Group: {group})')
+        ax.set_title(f'{prefix}Correlation Heatmap (Test Group: {group})')
     plt.tight_layout()
-    plt.savefig('statistical_plot.png')
+    plt.savefig(os.path.join(outdir, 'statistical_plot.png'))
     return
 
 
-def statistical_analysis(df, col: str):
+# Plot stages of main() and the functions that draw them
+PLOT_STAGES = {
+    "relational": plot_relational_plot,
+    "statistical": plot_statistical_plot,
+    "categorical": plot_categorical_plot,
+}
+
+
+def _render(plot, summary, outdir):
+    """
+    Draws one plot from summary into outdir with the Agg backend, closes
+    its figure and returns the elapsed time in seconds.
+    """
+    import matplotlib.pyplot as plt
+
+    start = time.perf_counter()
+    plt.switch_backend("Agg")
+    plot(None, summary, outdir)
+    plt.close("all")
+    return time.perf_counter() - start
+
+
+def render_plots(summary, parallel=False, outdir=".", stages=None):
+    """
+    Renders the plot stages given (by default all of PLOT_STAGES) from
+    summary into outdir, either one after another or concurrently in a
+    process pool, and returns the elapsed seconds of each stage.
+    """
+    stages = list(PLOT_STAGES) if stages is None else list(stages)
+    plots = [PLOT_STAGES[stage] for stage in stages]
+    if parallel and len(plots) > 1:
+        with ProcessPoolExecutor(max_workers=len(plots),
+                                 initializer=_untraced) as pool:
+            times = list(pool.map(_render, plots, [summary] * len(plots),
+                                  [outdir] * len(plots)))
+    else:
+        times = [_render(plot, summary, outdir) for plot in plots]
+    return dict(zip(stages, times))
+
+
+def statistical_analysis(df, col, by=None):
     """
     Computes statistical moments (mean, standard deviation, skewness,
-    excess kurtosis) for a given column.
+    excess kurtosis) for a given column, or for a list of columns at once
+    from a single 2-D array. If by is a column name (e.g. "test group"),
+    the moments are also computed per group from the same pass.
+
+    A single column without grouping gives a (mean, stddev, skew,
+    excess_kurtosis) tuple; otherwise a DataFrame with one row per column
+    (indexed by group and column when grouped) is returned.
     """
-    mean = df['total ads'].mean()
-    stddev = df['total ads'].std()
-    skew = ss.skew(df['total ads'])
-    excess_kurtosis = ss.kurtosis(df['total ads'])  
+    cols = [col] if isinstance(col, str) else list(col)
+    x = df[cols].to_numpy(dtype=np.float64)
+    if by is None:
+        acc = _chunk_moments(x)
+        moments = _finalise_moments(acc)
+        if isinstance(col, str):
+            return tuple(float(m[0]) for m in moments)
+        return pd.DataFrame(dict(zip(MOMENT_NAMES, moments)), index=cols)
+    keys = df[by].astype("category")
+    groups = keys.cat.categories
+    acc = _grouped_moments(x, keys.cat.codes.to_numpy(), len(groups))
+    moments = _finalise_moments(acc)
+    index = pd.MultiIndex.from_product([groups, cols], names=[by, None])
+    return pd.DataFrame({name: m.ravel()
+                         for name, m in zip(MOMENT_NAMES, moments)},
+                        index=index)
+
+
+def _chunk_moments(x):
+    """
+    Returns the moment accumulator (n, mean, M2, M3, M4) of the values in
+    x along axis 0, where Mk is the sum of k-th powers of deviations from
+    the mean.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if x.shape[0] == 0:
+        return (np.zeros(x.shape[1:]),) * 5
+    n = np.full(x.shape[1:], x.shape[0], dtype=np.float64)
+    mean = x.mean(axis=0)
+    d = x - mean
+    d2 = d * d
+    return (n, mean, d2.sum(axis=0), (d2 * d).sum(axis=0),
+            (d2 * d2).sum(axis=0))
+
+
+def _grouped_moments(x, codes, n_groups):
+    """
+    Returns moment accumulators of x per group, each of shape
+    (n_groups, n_columns), with group sums taken by one weighted
+    np.bincount per column over the integer group codes. Rows with a
+    missing group (code -1) are left out.
+    """
+    keep = codes >= 0
+    x, codes = x[keep], codes[keep]
+
+    def group_sums(values):
+        return np.stack([np.bincount(codes, weights=values[:, j],
+                                     minlength=n_groups)
+                         for j in range(values.shape[1])], axis=1)
+
+    n = np.repeat(np.bincount(codes, minlength=n_groups)[:, None],
+                  x.shape[1], axis=1).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(n > 0, group_sums(x) / n, 0.0)
+    d = x - mean[codes]
+    d2 = d * d
+    return (n, mean, group_sums(d2), group_sums(d2 * d),
+            group_sums(d2 * d2))
+
+
+def _merge_moments(a, b):
+    """
+    Combines two moment accumulators with the pairwise update formulas of
+    Pebay (2008), so chunks can be folded in one at a time.
+    """
+    n_a, mean_a, m2_a, m3_a, m4_a = a
+    n_b, mean_b, m2_b, m3_b, m4_b = b
+    n = n_a + n_b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        delta = mean_b - mean_a
+        delta_n = np.where(n > 0, delta / n, 0.0)
+    mean = mean_a + n_b * delta_n
+    m2 = m2_a + m2_b + delta * delta_n * n_a * n_b
+    m3 = (m3_a + m3_b
+          + delta * delta_n ** 2 * n_a * n_b * (n_a - n_b)
+          + 3 * delta_n * (n_a * m2_b - n_b * m2_a))
+    m4 = (m4_a + m4_b
+          + delta * delta_n ** 3 * n_a * n_b
+          * (n_a * n_a - n_a * n_b + n_b * n_b)
+          + 6 * delta_n ** 2 * (n_a * n_a * m2_b + n_b * n_b * m2_a)
+          + 4 * delta_n * (n_a * m3_b - n_b * m3_a))
+    return n, mean, m2, m3, m4
+
+
+def _finalise_moments(acc):
+    """
+    Turns a moment accumulator into (mean, standard deviation, skewness,
+    excess kurtosis), using the same conventions as pandas' std (ddof=1)
+    and scipy's biased skew and kurtosis.
+    """
+    n, mean, m2, m3, m4 = acc
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stddev = np.sqrt(m2 / (n - 1))
+        skew = np.sqrt(n) * m3 / m2 ** 1.5
+        excess_kurtosis = n * m4 / (m2 * m2) - 3.0
     return mean, stddev, skew, excess_kurtosis
 
 
-def preprocessing(df):
+def statistical_analysis_stream(path, col: str, chunksize=1_000_000):
+    """
+    Computes the same moments as statistical_analysis for a column of a
+    CSV that does not fit in memory, reading it in chunks and merging the
+    per-chunk moment accumulators in a single pass.
+    """
+    acc = _chunk_moments(np.empty((0, 1)))
+    for chunk in pd.read_csv(path, usecols=[col], dtype={col: SCHEMA[col]},
+                             chunksize=chunksize):
+        acc = _merge_moments(acc, _chunk_moments(chunk[[col]].to_numpy()))
+    return tuple(float(m[0]) for m in _finalise_moments(acc))
+
+
+def conversion_tallies(df, codes, n_strata, treatment="ad",
+                       control="psa"):
+    """
+    Returns an (n_strata, 2, 2) array counting the rows of each stratum
+    by test group (treatment, control) and converted (False, True),
+    from a single np.bincount over the integer stratum codes.
+    """
+    group = df["test group"].to_numpy()
+    arm = np.where(group == treatment, 0, np.where(group == control, 1, -1))
+    keep = (arm >= 0) & (codes >= 0)
+    key = (codes[keep] * 2 + arm[keep]) * 2 + df["converted"].to_numpy(
+        dtype=np.int64)[keep]
+    return np.bincount(key, minlength=n_strata * 4).reshape(n_strata, 2, 2)
+
+
+def ab_tests(counts, alpha=0.05):
+    """
+    Tests treatment against control in every stratum of counts (see
+    conversion_tallies) at once: a pooled two-proportion z-test, a
+    Pearson chi-square test of the 2x2 table and Wald confidence
+    intervals at level 1 - alpha for the absolute lift and, by the delta
+    method on the log ratio, the relative lift.
+    """
+    from scipy.special import chdtrc, ndtr, ndtri
+
+    counts = counts.astype(np.float64)
+    n = counts.sum(axis=2)
+    conv = counts[..., 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rate = conv / n
+        lift = rate[:, 0] - rate[:, 1]
+        pooled = conv.sum(axis=1) / n.sum(axis=1)
+        z = lift / np.sqrt(pooled * (1 - pooled)
+                           * (1 / n[:, 0] + 1 / n[:, 1]))
+        expected = (n[:, :, None] * counts.sum(axis=1)[:, None, :]
+                    / n.sum(axis=1)[:, None, None])
+        chi2 = ((counts - expected) ** 2 / expected).sum(axis=(1, 2))
+        crit = ndtri(1 - alpha / 2)
+        se = np.sqrt((rate * (1 - rate) / n).sum(axis=1))
+        log_ratio = np.log(rate[:, 0] / rate[:, 1])
+        se_log = np.sqrt(((1 - rate) / conv).sum(axis=1))
+        rel_low = np.exp(log_ratio - crit * se_log) - 1
+        rel_high = np.exp(log_ratio + crit * se_log) - 1
+    return pd.DataFrame({
+        "n_ad": n[:, 0], "n_psa": n[:, 1],
+        "rate_ad": rate[:, 0], "rate_psa": rate[:, 1],
+        "lift": lift,
+        "lift_low": lift - crit * se, "lift_high": lift + crit * se,
+        "rel_lift": np.exp(log_ratio) - 1,
+        "rel_lift_low": rel_low, "rel_lift_high": rel_high,
+        "z": z, "p_z": 2 * ndtr(-np.abs(z)),
+        "chi2": chi2, "p_chi2": chdtrc(1, chi2),
+    })
+
+
+def significance_analysis(df, num_bins=10, alpha=0.05, max_perm=0,
+                          seed=0, workers=1):
+    """
+    Runs ab_tests for ad against psa overall, per log bin of total ads,
+    per most ads day and per most ads hour, stacking the tallies of all
+    these strata into one batch, plus a permutation_test of up to
+    max_perm permutations if max_perm > 0. Returns a DataFrame indexed
+    by (facet, level).
+    """
+    facets = [("overall", np.zeros(len(df), dtype=np.int64), ["all"])]
+    codes, labels = log_bin(df["total ads"].to_numpy(), num_bins)
+    facets.append(("total ads", codes.astype(np.int64), labels))
+    for col in ["most ads day", "most ads hour"]:
+        keys = df[col].astype("category")
+        facets.append((col, keys.cat.codes.to_numpy(dtype=np.int64),
+                       [str(c) for c in keys.cat.categories]))
+    counts = np.concatenate([conversion_tallies(df, codes, len(labels))
+                             for _, codes, labels in facets])
+    results = ab_tests(counts, alpha)
+    if max_perm:
+        perm = permutation_test(counts, max_perm, alpha=alpha, seed=seed,
+                                workers=workers)
+        results = pd.concat([results, perm], axis=1)
+    results.index = pd.MultiIndex.from_tuples(
+        [(facet, label) for facet, _, labels in facets for label in labels],
+        names=["facet", "level"])
+    return results
+
+
+def _permutation_batch(counts, size, seed):
+    """
+    Returns, per stratum of counts, how many of size label permutations
+    give an absolute lift at least as large as the observed one. Under a
+    permutation the ad conversions are hypergeometric given the group
+    sizes and the total conversions, so no rows are shuffled.
+    """
+    rng = np.random.default_rng(seed)
+    n = counts.sum(axis=2)
+    conv = counts[..., 1]
+    total = conv.sum(axis=1)
+    draws = rng.hypergeometric(total, n.sum(axis=1) - total, n[:, 0],
+                               size=(size, len(counts)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        observed = np.abs(conv[:, 0] / n[:, 0] - conv[:, 1] / n[:, 1])
+        permuted = np.abs(draws / n[:, 0] - (total - draws) / n[:, 1])
+    return (permuted >= observed - 1e-12).sum(axis=0)
+
+
+def permutation_test(counts, max_perm=100_000, batch=5_000, alpha=0.05,
+                     seed=0, workers=1):
+    """
+    Two-sided permutation test of the ad vs psa lift in every stratum of
+    counts (see conversion_tallies), drawing batches of hypergeometric
+    permutations of the converted counts. Sampling stops early once the
+    99.9% interval of every stratum's p-value lies on one side of alpha,
+    or after max_perm permutations. Batches have seeds spawned from seed
+    and are evaluated in order, so with workers > 1 the extra batches of
+    a round are discarded and the result does not depend on workers.
+    Returns the p-values, with +1 smoothing, and the permutations used.
+    """
+    # The last batch is cut short so no more than max_perm are drawn
+    sizes = [min(batch, max_perm - start)
+             for start in range(0, max_perm, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    pool = (ProcessPoolExecutor(workers, initializer=_untraced)
+            if workers > 1 else None)
+
+    def batches():
+        # One round of workers batches at a time, yielded in seed order
+        for start in range(0, len(seeds), workers):
+            round_sizes = sizes[start:start + workers]
+            args = ([counts] * len(round_sizes), round_sizes,
+                    seeds[start:start + workers])
+            yield from zip(round_sizes,
+                           pool.map(_permutation_batch, *args) if pool
+                           else map(_permutation_batch, *args))
+
+    hits = np.zeros(len(counts), dtype=np.int64)
+    used = 0
+    try:
+        for size, batch_hits in batches():
+            hits += batch_hits
+            used += size
+            p = (hits + 1) / (used + 1)
+            if np.all(np.abs(p - alpha) > 3.29 * np.sqrt(p * (1 - p) / used)):
+                break
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    n = counts.sum(axis=2)
+    p = np.where((n > 0).all(axis=1), (hits + 1) / (used + 1), np.nan)
+    return pd.DataFrame({"p_perm": p, "n_perm": used})
+
+
+class SequentialMonitor:
+    """
+    Incremental ad vs psa monitor for rows that arrive in batches. Each
+    batch updates the (group, converted) counts and the per-group moment
+    accumulators of total ads, and the state never grows, so the cost of
+    an update does not depend on how much data came before. After every
+    batch a mixture sequential probability ratio test (mSPRT, Johari et
+    al. 2017) on the normal approximation of the lift gives an
+    always-valid p-value, so the experiment can be stopped as soon as it
+    drops below alpha without inflating the false positive rate. tau is
+    the standard deviation of the normal mixing prior on the lift.
+    """
+
+    def __init__(self, alpha=0.05, tau=0.01, groups=("ad", "psa")):
+        self.alpha = alpha
+        self.tau = tau
+        self.groups = list(groups)
+        self.counts = np.zeros((2, 2), dtype=np.int64)
+        self.moments = (np.zeros((2, 1)),) * 5
+        self.p_value = 1.0
+        self.offset = None
+        self.header = None
+
+    def update(self, group, converted, total_ads):
+        """
+        Folds in one batch of rows given as arrays of the test group,
+        converted and total ads columns and returns the current report.
+        """
+        group = np.asarray(group)
+        arm = np.where(group == self.groups[0], 0,
+                       np.where(group == self.groups[1], 1, -1))
+        keep = arm >= 0
+        arm = arm[keep]
+        converted = np.asarray(converted, dtype=np.int64)[keep]
+        total_ads = np.asarray(total_ads, dtype=np.float64)[keep]
+        self.counts += np.bincount(arm * 2 + converted,
+                                   minlength=4).reshape(2, 2)
+        self.moments = _merge_moments(
+            self.moments, _grouped_moments(total_ads[:, None], arm, 2))
+        self.p_value = min(self.p_value, 1 / self.likelihood_ratio())
+        return self.report()
+
+    def likelihood_ratio(self):
+        """
+        Returns the mSPRT mixture likelihood ratio of the current counts.
+        """
+        n = self.counts.sum(axis=1)
+        if (n == 0).any():
+            return 1.0
+        rate = self.counts[:, 1] / n
+        lift = rate[0] - rate[1]
+        var = (rate * (1 - rate) / n).sum()
+        if var == 0:
+            return 1.0
+        tau2 = self.tau ** 2
+        return (np.sqrt(var / (var + tau2))
+                * np.exp(tau2 * lift ** 2 / (2 * var * (var + tau2))))
+
+    def report(self):
+        """
+        Returns the counts, rates, lift, total ads moments per group and
+        the always-valid p-value with the stopping decision.
+        """
+        n = self.counts.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rate = self.counts[:, 1] / n
+        moments = np.column_stack([m[:, 0] for m in
+                                   _finalise_moments(self.moments)])
+        return {"n": dict(zip(self.groups, n.tolist())),
+                "rate": dict(zip(self.groups, rate.tolist())),
+                "lift": float(rate[0] - rate[1]),
+                "total ads": {group: dict(zip(MOMENT_NAMES, row))
+                              for group, row in zip(self.groups,
+                                                    moments.tolist())},
+                "p_value": float(self.p_value),
+                "stop": bool(self.p_value < self.alpha)}
+
+    def ingest_csv(self, path):
+        """
+        Reads only the complete rows appended to the CSV since the last
+        call, updates the monitor with them and returns the report.
+        """
+        with open(path, "rb") as f:
+            if self.offset is None:
+                self.header = f.readline().decode()
+                self.offset = f.tell()
+            f.seek(self.offset)
+            data = f.read()
+        data = data[:data.rfind(b"\n") + 1]
+        self.offset += len(data)
+        if not data:
+            return self.report()
+        cols = ["test group", "converted", "total ads"]
+        batch = pd.read_csv(io.StringIO(self.header + data.decode()),
+                            usecols=cols,
+                            dtype={col: SCHEMA[col] for col in cols})
+        return self.update(batch["test group"], batch["converted"],
+                           batch["total ads"])
+
+
+def _bootstrap_chunk(counts, statistic, size, seed):
+    """
+    Draws size multinomial resamples of each row of counts, keeping each
+    row's total, and returns statistic of the (size, rows, cells) draws.
+    """
+    rng = np.random.default_rng(seed)
+    draws = np.zeros((size,) + counts.shape, dtype=np.int64)
+    for i, row in enumerate(counts):
+        if row.sum() > 0:
+            draws[:, i] = rng.multinomial(row.sum(), row / row.sum(), size)
+    return statistic(draws)
+
+
+def bootstrap(counts, statistic, n_boot=1000, seed=0, workers=1):
+    """
+    Bootstraps statistic over aggregated tallies instead of rows: each
+    row of counts (e.g. one test group's cells) is resampled as a
+    multinomial with its own total, which is equivalent to resampling
+    that group's rows with replacement. The resamples are drawn in
+    fixed-size chunks with seeds spawned from seed, spread over a pool
+    of workers processes when workers > 1, so the result depends only
+    on seed. statistic must be picklable, e.g. a functools.partial of a
+    module-level function. Returns the stacked statistic values.
+    """
+    counts = np.atleast_2d(counts)
+    chunk = max(1, min(256, (1 << 22) // counts.size))
+    sizes = [min(chunk, n_boot - start) for start in range(0, n_boot, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = ([counts] * len(sizes), [statistic] * len(sizes), sizes, seeds)
+    if workers > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_untraced) as pool:
+            parts = list(pool.map(_bootstrap_chunk, *args))
+    else:
+        parts = list(map(_bootstrap_chunk, *args))
+    return np.concatenate(parts)
+
+
+def bootstrap_ci(samples, alpha=0.05):
+    """
+    Returns the (low, high) percentile interval at level 1 - alpha of
+    bootstrap samples along their first axis, ignoring undefined values.
+    """
+    with np.errstate(invalid="ignore"):
+        return np.nanpercentile(samples, [50 * alpha, 100 - 50 * alpha],
+                                axis=0)
+
+
+def _binned_rates(draws, shape):
+    """
+    Bootstrap statistic for aggregate: the conversion rates (%) per log
+    bin followed by those per ads category, for each resampled group.
+    """
+    cells = draws.reshape(draws.shape[:2] + shape)
+    binned = cells[:, :, 1:].sum(axis=3)
+    by_category = cells.sum(axis=2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.concatenate(
+            [binned[..., 1] / binned.sum(axis=-1),
+             by_category[..., 1] / by_category.sum(axis=-1)], axis=-1) * 100
+
+
+def _weighted_moments(draws, values):
+    """
+    Bootstrap statistic for bootstrap_moments: the moments of values
+    weighted by each resample's counts.
+    """
+    w = draws[:, 0].astype(np.float64)
+    n = w.sum(axis=1)
+    mean = w @ values / n
+    d = values - mean[:, None]
+    d2 = d * d
+    acc = (n, mean, (w * d2).sum(axis=1), (w * d2 * d).sum(axis=1),
+           (w * d2 * d2).sum(axis=1))
+    return np.column_stack(_finalise_moments(acc))
+
+
+def bootstrap_moments(df, col, n_boot=1000, seed=0, workers=1, alpha=0.05):
+    """
+    Returns bootstrap confidence intervals at level 1 - alpha for the
+    moments of statistical_analysis, resampling the counts of the
+    distinct values of col rather than its rows.
+    """
+    values, counts = np.unique(df[col].to_numpy(), return_counts=True)
+    samples = bootstrap(counts, partial(_weighted_moments,
+                                        values=values.astype(np.float64)),
+                        n_boot, seed, workers)
+    low, high = bootstrap_ci(samples, alpha)
+    return pd.DataFrame({"low": low, "high": high}, index=MOMENT_NAMES)
+
+
+QUANTILES = [0.25, 0.5, 0.75]
+
+
+def _histogram_quantiles(counts, qs):
+    """
+    Returns the quantiles qs of the integer values whose frequencies are
+    counts (value k occurring counts[k] times), interpolated linearly
+    between order statistics as pandas and numpy do by default.
+    """
+    cum = np.cumsum(counts)
+    pos = (cum[-1] - 1) * np.asarray(qs)
+    lower = np.floor(pos)
+    lo = np.searchsorted(cum, lower, side="right")
+    hi = np.searchsorted(cum, np.minimum(lower + 1, cum[-1] - 1),
+                         side="right")
+    return lo + (pos - lower) * (hi - lo)
+
+
+class QuantileSketch:
+    """
+    Mergeable KLL quantile sketch. Items are kept in levels of compactors,
+    an item at level h standing for 2**h original values; a full level is
+    sorted and every other item (from a random offset) is promoted to the
+    next level. The rank error of quantile() is about eps times the number
+    of values, whichever chunks or workers the sketch was built from.
+    """
+
+    def __init__(self, eps=0.01, seed=0):
+        self.eps = eps
+        self.k = int(np.ceil(3.0 / eps))
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                even = items[:len(items) - len(keep)]
+                promoted = even[self.rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate(
+                    [self.levels[level + 1], promoted])
+            level += 1
+        return
+
+    def update(self, values):
+        """
+        Adds an array of values (e.g. one chunk of a column) to the sketch.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        # Feed large chunks in slices so no single sort grows unbounded
+        step = max(self.k, 1 << 14)
+        for start in range(0, len(values), step):
+            self.levels[0] = np.concatenate(
+                [self.levels[0], values[start:start + step]])
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """
+        Folds another sketch (e.g. from another chunk or worker) into this
+        one and returns self.
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+        return self
+
+    def count(self):
+        """
+        Returns the number of values the sketch summarises.
+        """
+        return sum(len(items) << level
+                   for level, items in enumerate(self.levels))
+
+    def quantile(self, qs):
+        """
+        Returns the approximate quantiles qs, interpolated linearly
+        between the weighted items like np.quantile, or nan for an empty
+        sketch.
+        """
+        if not self.count():
+            return np.full(np.shape(qs), np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(items)
+        items, cum = items[order], np.cumsum(weights[order])
+        pos = (cum[-1] - 1) * np.asarray(qs)
+        lower = np.floor(pos)
+        lo = items[np.searchsorted(cum, lower, side="right")]
+        hi = items[np.searchsorted(cum, np.minimum(lower + 1, cum[-1] - 1),
+                                   side="right")]
+        return lo + (pos - lower) * (hi - lo)
+
+
+def sketch_column(path, col, eps=0.01, chunksize=1_000_000):
+    """
+    Builds a QuantileSketch of one column of a CSV, one sketch per chunk
+    merged as it goes, without loading the whole column.
+    """
+    sketch = QuantileSketch(eps)
+    for i, chunk in enumerate(pd.read_csv(path, usecols=[col],
+                                          chunksize=chunksize)):
+        sketch.merge(QuantileSketch(eps, seed=i).update(chunk[col]))
+    return sketch
+
+
+def _column_profile(values, eps=None):
+    """
+    Returns describe-style statistics of a numeric column. 8 and 16-bit
+    unsigned columns (such as "total ads" and "most ads hour") are
+    summarised exactly from a single np.bincount, other columns with
+    NumPy reductions. For the latter, giving eps replaces the exact
+    (sorting) quantiles with a QuantileSketch of that rank error.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "u" and values.dtype.itemsize <= 2:
+        counts = np.bincount(values)
+        k = np.arange(len(counts), dtype=np.float64)
+        n = counts.sum()
+        mean = counts @ k / n
+        var = counts @ (k - mean) ** 2 / (n - 1)
+        nonzero = np.flatnonzero(counts)
+        low, high = nonzero[0], nonzero[-1]
+        quantiles = _histogram_quantiles(counts, QUANTILES)
+        nulls = 0
+    else:
+        values = values.astype(np.float64)
+        nulls = int(np.isnan(values).sum())
+        values = values[~np.isnan(values)] if nulls else values
+        n, mean, var = len(values), values.mean(), values.var(ddof=1)
+        low, high = values.min(), values.max()
+        if eps is None:
+            quantiles = np.quantile(values, QUANTILES)
+        else:
+            sketch = QuantileSketch(eps).update(values)
+            quantiles = sketch.quantile(QUANTILES)
+    return {"count": n, "nulls": nulls, "mean": mean, "std": np.sqrt(var),
+            "min": low,
+            **{f"{q:.0%}": v for q, v in zip(QUANTILES, quantiles)},
+            "max": high}
+
+
+def profile(df, corr_cols=("total ads", "most ads hour"), eps=None,
+            method="pearson"):
+    """
+    Summarises df in one pass per column: a describe-style table of the
+    numeric (non-bool) columns, the missing-value count of every column
+    and the correlation matrix of corr_cols (see correlation), when they
+    are all present. eps turns on approximate quantiles (see
+    _column_profile).
+    """
+    numeric = [col for col in df.columns
+               if df[col].dtype.kind in "uif"]
+    summary = pd.DataFrame({col: _column_profile(df[col], eps)
+                            for col in numeric})
+    nulls = pd.Series(
+        {col: summary[col]["nulls"] if col in numeric
+         else (df[col].cat.codes.to_numpy() == -1).sum()
+         if isinstance(df[col].dtype, pd.CategoricalDtype)
+         else df[col].isna().sum()
+         for col in df.columns}, dtype=np.int64)
+    corr = None
+    if all(col in numeric for col in corr_cols):
+        corr = correlation(df, corr_cols, method)
+    return {"head": df.head(), "describe": summary.drop(index="nulls"),
+            "nulls": nulls, "corr": corr}
+
+
+def preprocessing(df, eps=None, method="pearson"):
     """
     Preporecessing function that does the following:
     - Displays first 5 rows
     - Shows summary statistics
     - Prints missing values count
     - Shows correlation matrix
+    The statistics come from profile, which scans each column once;
+    eps gives approximate quantiles with that rank error and method
+    picks the correlation (see correlation).
     """
-    print(df.head())
+    summary = profile(df, eps=eps, method=method)
 
-    print(df.describe())
+    print(summary["head"])
 
-    print(df.isnull().sum())
+    print(summary["describe"])
 
-    print(df[['total ads', 'most ads hour']].corr())
+    print(summary["nulls"])
+
+    if summary["corr"] is not None:
+        print(summary["corr"])
 
     return df
 
 
+STAGES = ["preprocess", "relational", "categorical", "statistical",
+          "moments", "significance", "sequential"]
+# Stages run when --stages is not given; the others must be asked for
+DEFAULT_STAGES = STAGES[:5]
+
+
 def writing(moments, col):
     print(f'For the attribute {col}:')
     print(f'Mean = {moments[0]:.2f}, '
@@ -140,19 +1701,221 @@ def writing(moments, col):
           f'Skewness = {moments[2]:.2f}, and '
           f'Excess Kurtosis = {moments[3]:.2f}.')
 
-    print('The data was right skewed and leptokurtic.')
+    skew = ('right skewed' if moments[2] > 0
+            else 'left skewed' if moments[2] < 0 else 'not skewed')
+    kurtosis = ('leptokurtic' if moments[3] > 0
+                else 'platykurtic' if moments[3] < 0 else 'mesokurtic')
+    print(f'The data was {skew} and {kurtosis}.')
+    return
+
+
+def writing_significance(results, alpha=0.05):
+    """
+    Prints the overall ad vs psa test and the strata where the lift is
+    significant at alpha.
+    """
+    overall = results.loc[('overall', 'all')]
+    print(f'Conversion rate ad = {overall["rate_ad"]:.2%}, '
+          f'psa = {overall["rate_psa"]:.2%}, lift = {overall["lift"]:.2%} '
+          f'({1 - alpha:.0%} CI {overall["lift_low"]:.2%} to '
+          f'{overall["lift_high"]:.2%}), z = {overall["z"]:.2f}, '
+          f'p = {overall["p_z"]:.2g}.')
+    significant = results.index[results['p_z'] < alpha].drop(
+        ('overall', 'all'), errors='ignore')
+    if 'p_perm' in results:
+        print(f'Permutation test: p = {overall["p_perm"]:.2g} '
+              f'from {int(overall["n_perm"]):,} permutations.')
+    print(f'Significant at {alpha:g} in {len(significant)} of '
+          f'{len(results) - 1} strata: '
+          + ', '.join(f'{facet} {level}' for facet, level in significant))
     return
 
 
-def main():
-    df = pd.read_csv('data.csv', index_col=0)
-    df = preprocessing(df)
-    col = 'total ads'
-    plot_relational_plot(df)
-    plot_statistical_plot(df)
-    plot_categorical_plot(df)
-    moments = statistical_analysis(df, col)
-    writing(moments, col)
+def monitor_batches(df, batch_size=10_000, alpha=0.05):
+    """
+    Replays df in arrival order through a SequentialMonitor, batch_size
+    rows at a time, and returns the report after the first batch at
+    which the test stops (or after the last batch) with the rows read.
+    """
+    monitor = SequentialMonitor(alpha)
+    result, rows = monitor.report(), 0
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size]
+        result = monitor.update(batch["test group"], batch["converted"],
+                                batch["total ads"])
+        rows = start + len(batch)
+        if result["stop"]:
+            break
+    return result, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Statistics and trends of the A/B advertising data.')
+    parser.add_argument('input', nargs='?', default='data.csv',
+                        help='CSV file, directory or quoted glob of CSV '
+                             'shards to analyse (default: data.csv)')
+    parser.add_argument('-o', '--outdir', default='.',
+                        help='directory for the plots (default: .)')
+    parser.add_argument('-c', '--columns', nargs='+', default=['total ads'],
+                        choices=[col for col, dtype in SCHEMA.items()
+                                 if dtype != 'category'],
+                        metavar='COLUMN',
+                        help='numeric or bool columns to compute moments '
+                             'for (default: total ads)')
+    parser.add_argument('-s', '--stages', nargs='+', choices=STAGES,
+                        default=DEFAULT_STAGES,
+                        help='stages to run (default: '
+                             + ' '.join(DEFAULT_STAGES) + ')')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='skip the plot stages')
+    parser.add_argument('--approx-quantiles', type=float, metavar='EPS',
+                        help='use quantile sketches with rank error EPS '
+                             'in preprocessing')
+    parser.add_argument('--corr-method', choices=CORR_METHODS,
+                        default='pearson',
+                        help='correlation for preprocessing and the '
+                             'heatmaps (default: pearson)')
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                        help='bootstrap resamples for the confidence '
+                             'intervals (default: 0, skip)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='bootstrap seed (default: 0)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes for the shards, bootstrap and '
+                             'permutation test (default: 1)')
+    parser.add_argument('--permutations', type=int, default=0,
+                        metavar='N',
+                        help='most permutations for the significance '
+                             'permutation test (default: 0, skip)')
+    parser.add_argument('--batch-size', type=int, default=10_000,
+                        help='rows per batch of the sequential monitor '
+                             '(default: 10000)')
+    parser.add_argument('--state', metavar='PATH',
+                        help='fold the input into the StatsState saved at '
+                             'PATH (created if missing) and draw the plots '
+                             'from all the data it holds')
+    parser.add_argument('--parallel', action='store_true',
+                        help='render the plots in a process pool')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record each stage\'s peak allocation with '
+                             'tracemalloc in report.json (slow; worker '
+                             'processes are not counted)')
+    parser.add_argument('--cache-shards', action='store_true',
+                        help='cache each shard of a sharded input beside '
+                             'it, as a single CSV always is')
+    args = parser.parse_args(argv)
+    stages = [stage for stage in args.stages
+              if not (args.no_plots and stage in PLOT_STAGES)]
+    plots = [stage for stage in stages if stage in PLOT_STAGES]
+    cols = args.columns if 'moments' in stages else []
+    os.makedirs(args.outdir, exist_ok=True)
+
+    report = []
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_before = peak_rss_mb()
+    print(f'Peak RSS before load: {rss_before:.1f} MB')
+    paths = shard_paths(args.input)
+    sharded = paths != [args.input]
+    if ((sharded or args.state) and 'statistical' in plots
+            and args.corr_method not in ('pearson', 'pointbiserial')):
+        parser.error(f'--corr-method {args.corr_method} needs the rows of '
+                     'a single CSV; sharded input and --state give '
+                     'Pearson heatmaps only')
+    shard_moments = None
+    if sharded:
+        # Plots and moments come from per-shard partial summaries; the
+        # rows are only loaded for the stages that need them
+        with instrument('shards', report) as record:
+            shard_state, shard_moments = aggregate_shards(
+                paths, cols, args.workers, args.cache_shards)
+            record['rows'] = shard_state.rows()
+        print(f'Aggregated {len(paths)} shards, '
+              f'{shard_state.rows():,} rows')
+        stages_needing_rows = [
+            stage for stage in stages
+            if stage in ('preprocess', 'significance', 'sequential')
+            or (stage == 'moments' and args.bootstrap)]
+    else:
+        stages_needing_rows = stages + (['statistical'] if args.state
+                                        else [])
+    df = None
+    if stages_needing_rows or not sharded:
+        needed = required_columns(stages_needing_rows, cols)
+        with instrument('load', report) as record:
+            df = load_data(args.input, not sharded or args.cache_shards,
+                           usecols=needed)
+            record['rows'] = len(df)
+        print(f'Peak RSS after load: {record["peak_rss_mb"]:.1f} MB')
+    rows = shard_state.rows() if sharded else len(df)
+    if args.state:
+        with instrument('state', report, rows):
+            state = (StatsState.load(args.state)
+                     if os.path.exists(args.state) else StatsState())
+            new = (shard_state if sharded
+                   else StatsState().update(
+                       df, source=args.input,
+                       digest=_source_digest(args.input)))
+            try:
+                state.merge(new)
+            except ValueError as err:
+                print(f'State {args.state} not updated: {err}')
+            else:
+                state.save(args.state)
+        print(f'State {args.state} now holds {state.rows():,} rows')
+    elif sharded:
+        state = shard_state
+    if 'preprocess' in stages:
+        with instrument('preprocess', report, len(df)):
+            df = preprocessing(df, args.approx_quantiles, args.corr_method)
+    if plots:
+        with instrument('aggregate', report, rows):
+            if args.state or sharded:
+                summary = state.summary(n_boot=args.bootstrap,
+                                        seed=args.seed, workers=args.workers)
+            else:
+                summary = aggregate(df, method=args.corr_method,
+                                    n_boot=args.bootstrap, seed=args.seed,
+                                    workers=args.workers)
+        if args.parallel:
+            with instrument('plots', report):
+                render_plots(summary, True, args.outdir, plots)
+        else:
+            for stage in plots:
+                with instrument(stage, report):
+                    render_plots(summary, False, args.outdir, [stage])
+    if 'moments' in stages:
+        with instrument('moments', report, rows):
+            table = (shard_moments if sharded
+                     else statistical_analysis(df, cols))
+            cis = {col: bootstrap_moments(df, col, args.bootstrap, args.seed,
+                                          args.workers)
+                   for col in cols if args.bootstrap}
+        for col in cols:
+            writing(tuple(table.loc[col]), col)
+            if col in cis:
+                print('95% bootstrap CI: ' + ', '.join(
+                    f'{name} {low:.2f} to {high:.2f}'
+                    for name, (low, high) in cis[col].iterrows()) + '.')
+    if 'significance' in stages:
+        with instrument('significance', report, len(df)):
+            results = significance_analysis(
+                df, max_perm=args.permutations, seed=args.seed,
+                workers=args.workers)
+        results.to_csv(os.path.join(args.outdir, 'significance.csv'))
+        writing_significance(results)
+    if 'sequential' in stages:
+        with instrument('sequential', report, len(df)):
+            result, rows = monitor_batches(df, args.batch_size)
+        print(f'Sequential test: always-valid p = {result["p_value"]:.2g} '
+              f'after {rows:,} rows, '
+              + ('stopped early.' if result['stop'] else 'not stopped.'))
+    write_report(report, os.path.join(args.outdir, 'report.json'),
+                 input=args.input, columns=cols,
+                 peak_rss_before_load_mb=rss_before)
+    if args.trace_memory:
+        tracemalloc.stop()
     return
 
 
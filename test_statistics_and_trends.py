@@ -0,0 +1,481 @@
+"""
+Regression tests for statistics_and_trends.py, checking the streaming,
+counting and sketching shortcuts against pandas and scipy on data.csv
+and on small synthetic frames. Run with `python -m unittest` (or
+pytest) from this directory.
+"""
+
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from functools import partial
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import scipy.stats as ss
+
+import statistics_and_trends as st
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.csv")
+
+
+def reference_moments(values):
+    """
+    Returns (mean, std, skew, excess kurtosis) from pandas and scipy.
+    """
+    values = pd.Series(values, dtype=np.float64)
+    return (values.mean(), values.std(), ss.skew(values),
+            ss.kurtosis(values))
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, "small.csv")
+        self.df = st.load_data(DATA, cache=False).iloc[:1000]
+        self.df.to_csv(self.path)
+        self.expected = st.read_csv_schema(self.path)
+
+    def bump_mtime(self):
+        stat = os.stat(self.path)
+        mtime = stat.st_mtime_ns + 10**9
+        os.utime(self.path, ns=(stat.st_atime_ns, mtime))
+        return mtime
+
+    def no_parsing(self):
+        return mock.patch.object(st, "read_csv_schema",
+                                 side_effect=AssertionError("re-parsed"))
+
+    def assert_loads(self, df, expected):
+        # Cached columns are memmaps; copy them for the strict type check
+        pd.testing.assert_frame_equal(df.copy(), expected)
+
+    def test_cache_hit_skips_parsing(self):
+        self.assert_loads(st.load_data(self.path), self.expected)
+        with self.no_parsing():
+            self.assert_loads(st.load_data(self.path), self.expected)
+
+    def test_mtime_change_only_rehashes(self):
+        st.load_data(self.path)
+        mtime = self.bump_mtime()
+        with self.no_parsing():
+            self.assert_loads(st.load_data(self.path), self.expected)
+        with open(os.path.join(self.path + ".cache", "meta.json")) as f:
+            self.assertEqual(json.load(f)["mtime_ns"], mtime)
+
+    def test_content_change_rebuilds(self):
+        old = st.load_data(self.path)
+        self.df.iloc[:500].to_csv(self.path)
+        self.bump_mtime()
+        new = st.load_data(self.path)
+        self.assert_loads(new, self.expected.iloc[:500])
+        # The frame loaded before the rebuild still maps its own data
+        self.assert_loads(old, self.expected)
+        cached = os.listdir(self.path + ".cache")
+        self.assertEqual(len(cached), len(st.SCHEMA) + 1)
+
+
+class MomentsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = st.load_data(DATA, cache=False)
+
+    def test_matches_scipy_on_data(self):
+        for col in ["total ads", "most ads hour", "converted"]:
+            np.testing.assert_allclose(
+                st.statistical_analysis(self.df, col),
+                reference_moments(self.df[col]), rtol=1e-10)
+
+    def test_pebay_merge_of_chunks(self):
+        x = self.df[["total ads"]].to_numpy()
+        acc = st._chunk_moments(np.empty((0, 1)))
+        for chunk in np.array_split(x, [1, 1000, 1000, 250_000]):
+            acc = st._merge_moments(acc, st._chunk_moments(chunk))
+        merged = [float(m[0]) for m in st._finalise_moments(acc)]
+        np.testing.assert_allclose(
+            merged, reference_moments(self.df["total ads"]), rtol=1e-10)
+
+    def test_stream_matches_in_memory(self):
+        np.testing.assert_allclose(
+            st.statistical_analysis_stream(DATA, "total ads",
+                                           chunksize=100_000),
+            st.statistical_analysis(self.df, "total ads"), rtol=1e-10)
+
+    def test_many_columns_and_groups(self):
+        cols = ["total ads", "most ads hour"]
+        table = st.statistical_analysis(self.df, cols, by="test group")
+        for (group, col), row in table.iterrows():
+            part = self.df.loc[self.df["test group"] == group, col]
+            np.testing.assert_allclose(row, reference_moments(part),
+                                       rtol=1e-10)
+
+    def test_grouped_skips_missing_keys(self):
+        df = pd.DataFrame({"g": ["a", "a", None, "b", "b", "b"],
+                           "x": [1.0, 2.0, 100.0, 3.0, 3.0, 3.5]})
+        table = st.statistical_analysis(df, "x", by="g")
+        for group in ["a", "b"]:
+            np.testing.assert_allclose(
+                table.loc[(group, "x")],
+                reference_moments(df.loc[df["g"] == group, "x"]),
+                rtol=1e-10)
+
+
+class AggregateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = st.load_data(DATA, cache=False)
+
+    def test_log_bin_matches_pd_cut(self):
+        values = self.df["total ads"]
+        bins = np.logspace(0, np.log10(values.max()), num=10)
+        expected = pd.cut(values, bins).cat.codes.to_numpy()
+        for array in [values.to_numpy(), values.to_numpy(np.float64)]:
+            codes, labels = st.log_bin(array)
+            np.testing.assert_array_equal(codes, expected)
+        self.assertEqual(labels, [f"{int(lo)}-{int(hi)}"
+                                  for lo, hi in zip(bins, bins[1:])])
+
+    def test_log_bin_is_memoized(self):
+        values = self.df["total ads"].to_numpy()
+        self.assertIs(st.log_bin(values)[0], st.log_bin(values.copy())[0])
+        self.assertIsNot(st.log_bin(values)[0],
+                         st.log_bin(values, num_bins=5)[0])
+
+    def test_rates_match_groupby(self):
+        summary = st.aggregate(self.df)
+        values = self.df["total ads"]
+        bins = np.logspace(0, np.log10(values.max()), num=10)
+        frame = self.df.assign(
+            bin=pd.cut(values, bins).cat.codes,
+            category=np.where(values > 100, "Above 100 Ads",
+                              "Below 100 Ads"))
+        binned = frame[frame["bin"] >= 0].groupby(
+            ["test group", "bin"], observed=True)["converted"].mean()
+        np.testing.assert_allclose(summary["relational"], binned * 100)
+        by_category = frame.groupby(
+            ["test group", "category"], observed=True)["converted"].mean()
+        np.testing.assert_allclose(summary["categorical"],
+                                   by_category * 100)
+        self.assertEqual(list(summary["categorical"].index),
+                         list(by_category.index))
+
+
+class CorrelationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = st.load_data(DATA, cache=False).iloc[:20_000]
+
+    def test_stream_correlations_match_pandas(self):
+        df = st.load_data(DATA, cache=False)
+        cols = ["converted", "total ads"]
+        result = st.stream_correlations(DATA, cols, chunksize=100_000)
+        self.assertEqual(list(result), ["ad", "psa"])
+        for group, matrix in result.items():
+            part = df.loc[df["test group"] == group, cols]
+            np.testing.assert_allclose(
+                matrix, part.astype(np.float64).corr(), atol=1e-10)
+
+    def test_pearson_matrix_matches_pandas(self):
+        cols = ["converted", "total ads", "most ads hour", "user id"]
+        np.testing.assert_allclose(
+            st.correlation(self.df, cols),
+            self.df[cols].astype(np.float64).corr(), atol=1e-10)
+
+    def test_by_skips_missing_keys(self):
+        df = pd.DataFrame({"g": ["a", None, "a", "b", "b", "a"],
+                           "x": [1, 2, 3, 4, 5, 7],
+                           "y": [2, 9, 1, 4, 6, 8]})
+        result = st.correlation(df, ["x", "y"], by="g")
+        self.assertEqual(list(result), ["a", "b"])
+        part = df[df["g"] == "a"][["x", "y"]].astype(np.float64)
+        np.testing.assert_allclose(result["a"], part.corr(), atol=1e-12)
+
+    def test_kendall_tau_b_with_ties(self):
+        for a, b in [("converted", "total ads"),
+                     ("total ads", "most ads hour")]:
+            expected = ss.kendalltau(self.df[a], self.df[b]).statistic
+            self.assertAlmostEqual(
+                st._kendall_tau(self.df[a].to_numpy(),
+                                self.df[b].to_numpy()), expected, 10)
+
+    def test_kendall_fallback_for_wide_tables(self):
+        rng = np.random.default_rng(0)
+        a, b = rng.normal(size=3000), rng.normal(size=3000)
+        self.assertGreater(3000 * 3000, st.KENDALL_TABLE_SIZE)
+        self.assertAlmostEqual(st._kendall_tau(a, b),
+                               ss.kendalltau(a, b).statistic, 10)
+
+    def test_counting_ranks(self):
+        for col in ["converted", "total ads", "most ads hour"]:
+            np.testing.assert_array_equal(
+                st._rank_column(self.df[col].to_numpy()),
+                ss.rankdata(self.df[col]))
+
+    def test_rank_methods_match_pandas(self):
+        cols = ["converted", "total ads", "most ads hour"]
+        for method in ["spearman", "kendall"]:
+            expected = self.df[cols].astype(np.float64).corr(method)
+            np.testing.assert_allclose(
+                st.correlation(self.df, cols, method), expected,
+                atol=1e-10)
+
+
+class QuantileSketchTest(unittest.TestCase):
+
+    def test_rank_error_within_eps(self):
+        eps = 0.01
+        rng = np.random.default_rng(1)
+        values = rng.lognormal(size=200_000)
+        sketch = st.QuantileSketch(eps)
+        for i, chunk in enumerate(np.array_split(values, 7)):
+            sketch.merge(st.QuantileSketch(eps, seed=i).update(chunk))
+        self.assertEqual(sketch.count(), len(values))
+        qs = np.linspace(0.01, 0.99, 99)
+        ranks = np.searchsorted(np.sort(values), sketch.quantile(qs))
+        error = np.abs(ranks - qs * len(values)).max() / len(values)
+        self.assertLessEqual(error, eps)
+
+    def test_empty_sketch(self):
+        self.assertTrue(np.isnan(st.QuantileSketch().quantile(0.5)))
+        self.assertTrue(np.isnan(
+            st.QuantileSketch().quantile([0.25, 0.75])).all())
+
+
+STRATA = np.array([[[400, 30], [380, 22]],
+                   [[90, 12], [60, 3]],
+                   [[1000, 40], [950, 38]]])
+
+
+class SignificanceTest(unittest.TestCase):
+
+    def test_ab_tests_match_chi2_contingency(self):
+        result = st.ab_tests(STRATA)
+        for stratum, (_, row) in zip(STRATA, result.iterrows()):
+            chi2, p, _, _ = ss.chi2_contingency(stratum, correction=False)
+            self.assertAlmostEqual(row["chi2"], chi2, 10)
+            self.assertAlmostEqual(row["p_chi2"], p, 12)
+            # The pooled z-test is the square root of the 2x2 chi-square
+            self.assertAlmostEqual(row["z"] ** 2, chi2, 10)
+            self.assertAlmostEqual(row["p_z"], p, 12)
+
+    def test_tallies_match_crosstab(self):
+        df = st.load_data(DATA, cache=False)
+        codes = np.zeros(len(df), dtype=np.int64)
+        expected = pd.crosstab(df["test group"], df["converted"])
+        np.testing.assert_array_equal(
+            st.conversion_tallies(df, codes, 1)[0],
+            expected.loc[["ad", "psa"]].reindex(columns=[False, True]))
+
+
+class BootstrapTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = st.load_data(DATA, cache=False).iloc[:20_000]
+
+    def test_independent_of_workers(self):
+        statistic = partial(st._binned_rates, shape=(1, 2, 2))
+        counts = STRATA[:2].reshape(2, 4)
+        serial = st.bootstrap(counts, statistic, 700, seed=5)
+        self.assertEqual(len(serial), 700)
+        np.testing.assert_array_equal(
+            st.bootstrap(counts, statistic, 700, seed=5, workers=3), serial)
+        pd.testing.assert_frame_equal(
+            st.bootstrap_moments(self.df, "total ads", 600, workers=1),
+            st.bootstrap_moments(self.df, "total ads", 600, workers=2))
+
+    def test_intervals_cover_the_rates(self):
+        summary = st.aggregate(self.df, n_boot=300, seed=1)
+        ci = summary["categorical_ci"]
+        rates = summary["categorical"]
+        self.assertTrue(((ci["low"] <= rates) & (rates <= ci["high"])).all())
+
+
+def exact_p_value(stratum):
+    """
+    Returns the exact two-sided permutation p-value of the lift in one
+    (2, 2) stratum from the hypergeometric distribution of ad
+    conversions given the margins.
+    """
+    n = stratum.sum(axis=1)
+    total = stratum[:, 1].sum()
+    k = np.arange(max(0, total - n[1]), min(total, n[0]) + 1)
+    observed = abs(stratum[0, 1] / n[0] - stratum[1, 1] / n[1])
+    lift = np.abs(k / n[0] - (total - k) / n[1])
+    pmf = ss.hypergeom.pmf(k, n.sum(), total, n[0])
+    return pmf[lift >= observed - 1e-12].sum()
+
+
+class PermutationTest(unittest.TestCase):
+
+    def test_matches_exact_tail(self):
+        result = st.permutation_test(STRATA, max_perm=20_000, seed=3)
+        used = result["n_perm"].iloc[0]
+        for stratum, p in zip(STRATA, result["p_perm"]):
+            exact = exact_p_value(stratum)
+            self.assertLess(abs(p - exact),
+                            4 * np.sqrt(exact * (1 - exact) / used)
+                            + 1 / used)
+
+    def test_max_perm_is_an_upper_bound(self):
+        counts = np.array([[[400, 30], [380, 28]]])
+        for max_perm in [1000, 7300]:
+            result = st.permutation_test(counts, max_perm=max_perm)
+            self.assertLessEqual(result["n_perm"].iloc[0], max_perm)
+        result = st.permutation_test(counts, max_perm=1000)
+        self.assertEqual(result["n_perm"].iloc[0], 1000)
+
+
+class SequentialMonitorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = st.load_data(DATA, cache=False).iloc[:3000]
+
+    def test_ingest_csv_waits_for_complete_rows(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, "events.csv")
+        text = self.df.to_csv()
+        # Cut the file in the middle of a row
+        cut = text.index("\n", len(text) // 2) + 5
+        with open(path, "w") as f:
+            f.write(text[:cut])
+        monitor = st.SequentialMonitor()
+        first = monitor.ingest_csv(path)
+        complete = text.count("\n", 0, cut) - 1
+        self.assertEqual(sum(first["n"].values()), complete)
+        with open(path, "a") as f:
+            f.write(text[cut:])
+        last = monitor.ingest_csv(path)
+        expected = st.SequentialMonitor().update(
+            self.df["test group"], self.df["converted"],
+            self.df["total ads"])
+        self.assertEqual(last["n"], expected["n"])
+        self.assertEqual(last["rate"], expected["rate"])
+        for group, moments in expected["total ads"].items():
+            np.testing.assert_allclose(
+                list(last["total ads"][group].values()),
+                list(moments.values()), rtol=1e-10)
+
+    def test_monitor_batches_on_empty_frame(self):
+        result, rows = st.monitor_batches(self.df.iloc[:0])
+        self.assertEqual(rows, 0)
+        self.assertEqual(result["p_value"], 1.0)
+        self.assertFalse(result["stop"])
+
+
+class StatsStateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = st.load_data(DATA, cache=False)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def assert_summaries_equal(self, actual, expected):
+        for key in ["relational", "categorical"]:
+            pd.testing.assert_series_equal(actual[key], expected[key],
+                                           check_names=False)
+        for group, matrix in expected["statistical"].items():
+            np.testing.assert_allclose(actual["statistical"][group], matrix,
+                                       rtol=1e-10)
+
+    def test_merge_save_load_matches_aggregate(self):
+        halves = [self.df.iloc[:300_000], self.df.iloc[300_000:]]
+        state = st.StatsState().update(halves[0])
+        state.merge(st.StatsState().update(halves[1]))
+        path = os.path.join(self.tmp, "state.npz")
+        state.save(path)
+        loaded = st.StatsState.load(path)
+        self.assertEqual(loaded.rows(), len(self.df))
+        self.assert_summaries_equal(loaded.summary(), st.aggregate(self.df))
+        np.testing.assert_allclose(
+            loaded.moments().loc["ad"],
+            st.statistical_analysis(
+                self.df[self.df["test group"] == "ad"], "total ads"),
+            rtol=1e-10)
+
+    def test_refuses_a_file_twice(self):
+        path = os.path.join(self.tmp, "day.csv")
+        self.df.iloc[:1000].to_csv(path)
+        state = st.StatsState().update_csv(path)
+        with self.assertRaises(ValueError):
+            state.update_csv(path)
+        saved = os.path.join(self.tmp, "state.npz")
+        state.save(saved)
+        with self.assertRaises(ValueError):
+            st.StatsState.load(saved).merge(
+                st.StatsState().update(self.df.iloc[:1000], source=path))
+        self.assertEqual(state.rows(), 1000)
+
+    def test_identical_files_are_distinct_sources(self):
+        state = st.StatsState()
+        for name in ["day1.csv", "day2.csv"]:
+            path = os.path.join(self.tmp, name)
+            self.df.iloc[:0].to_csv(path)
+            state.update_csv(path)
+        self.assertEqual(len(state.sources), 2)
+        self.assertEqual(state.rows(), 0)
+
+    def test_empty_summary(self):
+        with self.assertRaises(ValueError):
+            st.StatsState().summary()
+
+
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.df = st.load_data(DATA, cache=False)
+        bounds = [0, 150_000, 400_000, len(self.df)]
+        for i, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            self.df.iloc[start:end].to_csv(
+                os.path.join(self.tmp, f"part{i}.csv"))
+
+    def test_shards_match_single_frame(self):
+        paths = st.shard_paths(self.tmp)
+        state, moments = st.aggregate_shards(paths, ["total ads"])
+        self.assertEqual(state.rows(), len(self.df))
+        np.testing.assert_allclose(
+            moments.loc["total ads"],
+            st.statistical_analysis(self.df, "total ads"), rtol=1e-10)
+
+    def test_glob_skips_cache_directories(self):
+        pattern = os.path.join(self.tmp, "part*")
+        st.aggregate_shards(st.shard_paths(pattern), cache=True)
+        self.assertEqual(len(st.shard_paths(pattern)), 3)
+        self.assertEqual(len(st.load_data(pattern)), len(self.df))
+
+    def test_empty_shards(self):
+        # Header-only shards, e.g. days without events, have equal bytes
+        for name in ["part8.csv", "part9.csv"]:
+            self.df.iloc[:0].to_csv(os.path.join(self.tmp, name))
+        paths = st.shard_paths(self.tmp)
+        state, moments = st.aggregate_shards(paths, ["total ads"])
+        self.assertEqual(state.rows(), len(self.df))
+        self.assertEqual(len(state.sources), 5)
+        np.testing.assert_allclose(
+            moments.loc["total ads"],
+            st.statistical_analysis(self.df, "total ads"), rtol=1e-10)
+        with contextlib.redirect_stdout(io.StringIO()):
+            st.main([self.tmp, "-s", "moments", "-o",
+                     os.path.join(self.tmp, "out")])
+
+
+if __name__ == "__main__":
+    unittest.main()